@@ -0,0 +1,413 @@
+"""Micro-benchmarks for the game's hot paths.
+
+Usage: python bench.py [name ...]
+
+Runs every benchmark when no name is given. Nothing opens a window; SDL
+uses the dummy video driver.
+"""
+import os
+import sys
+import time
+import argparse
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+
+
+def best_of(func, repeat=5, number=1):
+    """Return the best per-call time of ``func`` in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = (time.perf_counter() - start) / number
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def format_time(seconds):
+    if seconds < 1e-3:
+        return '%.2f us' % (seconds * 1e6)
+    return '%.3f ms' % (seconds * 1e3)
+
+
+def report(label, value):
+    print('  %-44s %s' % (label, value))
+
+
+def bench_flood():
+    from utils import neighbour_cells, neighbour_table
+
+    def fill_cells(width, height):
+        # Flood fill over cell tuples, as the engine did before the tables
+        start = (0, 0)
+        cells = [start]
+        seen = {start}
+        for cell in cells:
+            for next_cell in neighbour_cells(cell, width, height):
+                if next_cell not in seen:
+                    seen.add(next_cell)
+                    cells.append(next_cell)
+        return len(cells)
+
+    def fill_table(width, height):
+        neighbours = neighbour_table(width, height)
+        cells = [0]
+        seen = {0}
+        for index in cells:
+            for next_index in neighbours[index]:
+                if next_index not in seen:
+                    seen.add(next_index)
+                    cells.append(next_index)
+        return len(cells)
+
+    for width, height in ((17, 17), (100, 100), (400, 400)):
+        assert fill_cells(width, height) == fill_table(width, height) == width * height
+        repeat = 5 if width * height < 10000 else 3
+        number = max(1, 20000 // (width * height))
+        before = best_of(lambda: fill_cells(width, height), repeat, number)
+        after = best_of(lambda: fill_table(width, height), repeat, number)
+        report('%dx%d full grid fill, neighbour_cells' % (width, height), format_time(before))
+        report('%dx%d full grid fill, neighbour_table' % (width, height),
+               '%s (%.1fx)' % (format_time(after), before / after))
+
+
+def bench_hover():
+    import pygame
+    from board import Board
+    from constants import SCREEN_WIDTH, SCREEN_HEIGHT
+
+    pygame.init()
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    board = Board()
+    board.init()
+    bubble = next(bubble for bubble in board.grid_bubbles if bubble)
+    pos = bubble.rect.center
+    # One color everywhere, so the hovered group is every grid bubble
+    for other in board.grid_bubbles:
+        if other:
+            other.color = bubble.color
+
+    def hover(cached):
+        # Worst case: the hovered group shimmers again every frame
+        bubble.shimmer = 0
+        if not cached:
+            board.shimmer_waves.clear()
+        board.hover(pos)
+
+    report('Board.hover(), one-color group, uncached', format_time(
+        best_of(lambda: hover(False), number=1000)))
+    report('Board.hover(), one-color group, cached', format_time(
+        best_of(lambda: hover(True), number=1000)))
+
+
+def bench_images():
+    import pygame
+    from board import Board
+    from constants import COLORS
+    from bubble import bubble_images, load_bubble_image
+
+    pygame.init()
+    board = Board()
+
+    loads = [0]
+    loader = bubble_images.loader
+
+    def counting_loader(color):
+        loads[0] += 1
+        return loader(color)
+
+    bubble_images.loader = counting_loader
+    bubble_images.clear()
+    board.init()
+    bubble_images.loader = loader
+    sprites = len(board.bubbles) + len(board.elements)
+
+    def cold_init():
+        bubble_images.clear()
+        board.init()
+
+    def per_sprite_loads():
+        for i in range(sprites):
+            load_bubble_image(COLORS[i % len(COLORS)])
+
+    report('sprites created by Board.init()', sprites)
+    report('surfaces drawn, per-sprite loading', sprites)
+    report('surfaces drawn, shared cache', loads[0])
+    report('Board.init(), cold cache', format_time(best_of(cold_init)))
+    report('Board.init(), warm cache', format_time(best_of(board.init)))
+    report('load_bubble_image() per sprite', format_time(best_of(per_sprite_loads)))
+
+
+def bench_collisions():
+    import pygame
+    from bubble import Bubble
+    from constants import BUBBLE_SIZE, SHOT_SPEED, COLORS
+    from utils import get_center, get_distance, segment_cells
+
+    pygame.init()
+    width = 50
+    for count in (150, 500, 1000, 2000):
+        height = -(-count // width)
+        group = pygame.sprite.Group()
+        cells = {}
+        for i in range(count):
+            cx, cy = i % width, i // width
+            x, y = get_center(cx, cy)
+            bubble = Bubble(x, y, 0, 0, COLORS[i % len(COLORS)], cx, cy)
+            group.add(bubble)
+            cells[(cx, cy)] = bubble
+
+        # A shot just below the lowest row, touching nothing yet
+        x, y = get_center(width // 2, height + 1)
+        shot = Bubble(x, y, 0, 0, COLORS[0], -1, -1)
+
+        def sprite_collide():
+            pygame.sprite.spritecollide(shot, group, False, pygame.sprite.collide_circle)
+
+        def cell_lookup():
+            # The cells near one frame of movement at the default speed
+            start, end = (shot.x, shot.y), (shot.x, shot.y - SHOT_SPEED)
+            reach = BUBBLE_SIZE * 0.7
+            for cell in segment_cells(start, end, reach, width=width, height=height + 2):
+                bubble = cells.get(cell)
+                if bubble and get_distance((shot.x, shot.y), (bubble.x, bubble.y)) < reach:
+                    break
+
+        report('%d bubbles, spritecollide' % count, format_time(best_of(sprite_collide, number=200)))
+        report('%d bubbles, cell index' % count, format_time(best_of(cell_lookup, number=200)))
+
+
+def bench_match():
+    from array import array
+    from engine import Engine, EMPTY, GRID_SIZE
+    from utils import cell_index
+    from constants import GRID_WIDTH, GRID_HEIGHT
+
+    # Worst case: every cell shares one color, so a match takes the grid
+    engine = Engine()
+    full = array('b', [0]) * GRID_SIZE
+    cell = (GRID_WIDTH // 2, GRID_HEIGHT - 1)
+
+    def traverse():
+        engine.cells = array('b', full)
+        engine.count = GRID_SIZE
+        engine.traverse(cell)
+
+    def match_size():
+        engine.match_size(cell, 0)
+
+    def remove_disjoint():
+        engine.cells = array('b', full)
+        engine.count = GRID_SIZE
+        engine.changed_cells = set()
+        engine.remove([(GRID_WIDTH // 2, GRID_HEIGHT // 2)])
+        engine.remove_disjoint()
+
+    report('Engine.traverse(), one-color grid', format_time(best_of(traverse, number=100)))
+    report('Engine.remove_disjoint(), one bubble removed',
+           format_time(best_of(remove_disjoint, number=100)))
+    engine.cells = array('b', full)
+    engine.cells[cell_index(cell)] = EMPTY
+    report('Engine.match_size(), one-color grid', format_time(best_of(match_size, number=100)))
+
+
+def bench_removal():
+    import pygame
+    from board import Board
+    from constants import SCREEN_WIDTH, SCREEN_HEIGHT
+
+    pygame.init()
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    board = Board()
+    for count in (3, 40, 150):
+        board.init()
+        cells = [cell for cell, _ in board.engine.occupied()][:count]
+        board.state = Board.REMOVING_BUBBLES
+        board.start_removing(cells)
+        ticks = 0
+        start = time.perf_counter()
+        while board.removing_bubbles:
+            board.check_removing_bubbles()
+            ticks += 1
+        elapsed = time.perf_counter() - start
+        report('remove %d bubbles' % len(cells),
+               '%d ticks, %s per tick' % (ticks, format_time(elapsed / ticks)))
+
+
+def bench_render():
+    import pygame
+    from board import Board
+    from constants import SCREEN_WIDTH, SCREEN_HEIGHT, BACKGROUND
+
+    pygame.init()
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    board = Board()
+    board.init()
+    background = pygame.Surface(screen.get_size())
+    background.fill(BACKGROUND)
+    board.sprites.clear(screen, background)
+    board.sprites.draw(screen)
+    # One bubble moving, as while a shot is in flight
+    bubble = board.second_preview_bubble
+
+    def full_redraw():
+        bubble.rect.x ^= 1
+        screen.fill(BACKGROUND)
+        board.bubbles.draw(screen)
+        board.elements.draw(screen)
+        pygame.display.flip()
+
+    def dirty_redraw():
+        bubble.rect.x ^= 1
+        bubble.dirty = 1
+        pygame.display.update(board.sprites.draw(screen))
+
+    report('full redraw per frame, %d sprites' % len(board.sprites),
+           format_time(best_of(full_redraw, number=50)))
+    report('dirty redraw per frame, %d sprites' % len(board.sprites),
+           format_time(best_of(dirty_redraw, number=50)))
+
+
+def bench_startup():
+    import subprocess
+
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    def run(code):
+        return subprocess.check_output([sys.executable, '-c', code], cwd=directory).decode().strip()
+
+    def cold_start(code):
+        return best_of(lambda: run(code))
+
+    interpreter = cold_start('pass')
+    report('python -c pass', format_time(interpreter))
+    for module in ('engine', 'stats', 'simulate', 'swap_engine', 'swap_simulate', 'board', 'draw'):
+        elapsed = cold_start('import %s' % module) - interpreter
+        loads = run('import sys, %s; print("pygame" in sys.modules)' % module) == 'True'
+        report('import %s%s' % (module, ' (loads pygame)' if loads else ''), format_time(elapsed))
+
+
+def bench_stats():
+    import json
+    import random
+    import tempfile
+    from pathlib import Path
+    import stats
+    from simulate import play_game
+
+    random.seed(0)
+    record = play_game(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / 'stats.jsonl'
+        for count in (1000, 100000):
+            with open(path, 'w') as f:
+                for _ in range(count):
+                    f.write(json.dumps(record) + '\n')
+            stats.rebuild_stats_index(path)
+
+            def full_scan():
+                stats.rebuild_stats_index(path)
+
+            def game_over():
+                stats.append_stats(record, path)
+                stats.load_aggregate_stats(path)
+
+            def filtered_query():
+                stats.aggregate_records(stats.filter_records(
+                    stats.iter_records(path), stats.result_is('win'), stats.started_between('2000-01-01')))
+
+            report('%d records, rebuild index' % count, format_time(best_of(full_scan, repeat=3)))
+            report('%d records, filtered streaming query' % count,
+                   format_time(best_of(filtered_query, repeat=3)))
+            report('%d records, append + load aggregates' % count,
+                   format_time(best_of(game_over, number=20)))
+
+        import numpy as np
+        import stats_columns
+
+        columns_path = Path(directory) / 'stats.cols'
+        stats_columns.append_rows(np.repeat(stats_columns.encode_records([record]), 1000000), columns_path)
+
+        def column_aggregates():
+            stats_columns.aggregate_columns(stats_columns.load_columns(columns_path))
+
+        def column_histogram():
+            stats_columns.histogram(stats_columns.load_columns(columns_path), 'shots_fired')
+
+        report('1000000 records, columnar aggregates', format_time(best_of(column_aggregates, repeat=3)))
+        report('1000000 records, columnar shots histogram',
+               format_time(best_of(column_histogram, repeat=3)))
+
+
+def bench_swap():
+    import random
+    from swap_engine import SwapEngine
+
+    random.seed(0)
+    engine = SwapEngine()
+    engine.reset()
+    cell1, cell2 = engine.valid_moves[0]
+
+    def play_moves():
+        for _ in range(100):
+            engine.swap(*random.choice(engine.valid_moves))
+
+    report('find_matches(), whole grid', format_time(best_of(engine.find_matches, number=1000)))
+    report('find_matches(), runs through a swap',
+           format_time(best_of(lambda: engine.find_matches([cell1, cell2]), number=1000)))
+    report('find_valid_moves()', format_time(best_of(engine.find_valid_moves, number=1000)))
+    report('SwapEngine.swap() with cascade, per move', format_time(best_of(play_moves) / 100))
+
+
+def bench_trace():
+    import math
+    import random
+    from engine import Engine
+
+    random.seed(0)
+    engine = Engine()
+    engine.new_game()
+    angles = [-random.uniform(0.1, math.pi - 0.1) for _ in range(100)]
+
+    def trace_shots():
+        for angle in angles:
+            engine.trace(angle)
+
+    report('Engine.trace() per shot, %d bubbles' % engine.count,
+           format_time(best_of(trace_shots) / len(angles)))
+
+
+BENCHMARKS = {
+    'collisions': bench_collisions,
+    'flood': bench_flood,
+    'hover': bench_hover,
+    'images': bench_images,
+    'match': bench_match,
+    'removal': bench_removal,
+    'render': bench_render,
+    'startup': bench_startup,
+    'stats': bench_stats,
+    'swap': bench_swap,
+    'trace': bench_trace,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('names', nargs='*',
+                        help='benchmarks to run (default: all): %s' % ', '.join(sorted(BENCHMARKS)))
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in BENCHMARKS:
+            parser.error('unknown benchmark: %s' % name)
+    for name in args.names or sorted(BENCHMARKS):
+        print(name)
+        BENCHMARKS[name]()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,20 +1,24 @@
 import math
-import random
 import logging
 import pygame
 
 from constants import (
-    BUBBLE_SIZE, GRID_WIDTH, GRID_HEIGHT, INIT_HEIGHT,
+    BUBBLE_SIZE, GRID_WIDTH, GRID_HEIGHT, COLORS,
     SCREEN_WIDTH, SCREEN_HEIGHT, BUBBLE_SPACE,
-    PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y,
-    GAME_OVER_EVENT, STATE_CHANGE_EVENT, TRAVERSE_EVENT,
-    TRIES, GREY, COLORS, DEBUG,
+    PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y, SHOT_SPEED,
+    REMOVE_STAGGER, REMOVE_TICKS, GREY, DEBUG,
 )
-from utils import get_center, get_distance, neighbour_cells
+from utils import get_center, get_cell, cell_index, NEIGHBOURS
 from bubble import Bubble
+from engine import Engine, WIN, LOSS, GRID_SIZE
 
 logger = logging.getLogger(__name__)
 
+# Custom events
+GAME_OVER_EVENT = pygame.USEREVENT
+STATE_CHANGE_EVENT = pygame.USEREVENT + 1
+TRAVERSE_EVENT = pygame.USEREVENT + 2
+
 
 class Board:
     REMOVE_DISJOINT = 'REMOVE_DISJOINT'
@@ -34,21 +38,27 @@ class Board:
     }
 
     def __init__(self, stats=None):
-        self.stats = stats
+        # Game rules; the sprites below only animate its state
+        self.engine = Engine(stats=stats)
         self.second_preview_bubble = None
         self.preview_bubble = None
         self.current_bubble = None
         # Group for all bubbles
         self.bubbles = pygame.sprite.Group()
         self.elements = pygame.sprite.Group()
+        # Everything drawn on screen, redrawn only where it changed
+        self.sprites = pygame.sprite.LayeredDirty()
+        # Grid bubbles by cell index, parallel to engine.cells
+        self.grid_bubbles = [None] * GRID_SIZE
+        # (index, depth) lists from shimmer_wave(), dropped whenever
+        # grid_bubbles changes
+        self.shimmer_waves = {}
         # Speed modifier
-        self.speed = 12  # Default speed
-        self.colors = list(COLORS)
+        self.speed = SHOT_SPEED
         self._state = Board.RELOAD
+        # (start tick, bubble) for each bubble being blown away
         self.removing_bubbles = []
-        self.step = 0
-        self.tries = -1
-        self.refresh_tries()
+        self.removing_tick = 0
 
     @property
     def state(self):
@@ -60,6 +70,24 @@ class Board:
             logger.debug('Set state: old_state = %s, new_state = %s', self._state, state)
         self._state = state
 
+    @property
+    def step(self):
+        return self.engine.step
+
+    @property
+    def tries(self):
+        return self.engine.tries
+
+    @property
+    def colors(self):
+        return self.engine.colors
+
+    @property
+    def at_rest(self):
+        """Whether the engine has resolved every shot fired so far."""
+        # A fired shot leaves no preview bubble until the next reload
+        return self.state == Board.READY and self.preview_bubble is not None
+
     def trigger_game_over(self, win):
         logger.debug("Game over (win=%s)", win)
         event = pygame.event.Event(GAME_OVER_EVENT, message=win)
@@ -77,285 +105,189 @@ class Board:
         event = pygame.event.Event(TRAVERSE_EVENT, message=cell)
         pygame.event.post(event)
 
-    def refresh_tries(self):
-        self.tries = TRIES[self.step % len(TRIES)]
+    def check_game_over(self):
+        if self.engine.result == LOSS:
+            self.trigger_game_over(win=False)
+
+    def bubble_at(self, cell):
+        index = cell_index(cell)
+        if index is None:
+            return None
+        return self.grid_bubbles[index]
+
+    def index_bubble(self, bubble, old_cell):
+        """Move ``bubble`` from ``old_cell`` to its current cell in grid_bubbles."""
+        index = cell_index(old_cell)
+        if index is not None and self.grid_bubbles[index] is bubble:
+            self.grid_bubbles[index] = None
+        index = cell_index((bubble.cx, bubble.cy))
+        if index is not None:
+            self.grid_bubbles[index] = bubble
+        self.shimmer_waves.clear()
+
+    def unindex_bubble(self, bubble):
+        index = cell_index((bubble.cx, bubble.cy))
+        if index is not None and self.grid_bubbles[index] is bubble:
+            self.grid_bubbles[index] = None
+            self.shimmer_waves.clear()
+
+    def create_bubble(self, cell, color):
+        cx, cy = cell
+        x, y = get_center(cx, cy)
+        bubble = Bubble(x, y, 0, 0, COLORS[color], cx, cy, board=self)
+        self.bubbles.add(bubble)
+        self.sprites.add(bubble)
+        self.grid_bubbles[cell_index(cell)] = bubble
+        self.shimmer_waves.clear()
+        return bubble
 
     def advance(self):
-        # Add new row on top
-        grid = self.build_grid()
-        for cell, bubble in grid.items():
+        # Follow the engine's new row on top, moving the bottom rows first
+        for index in reversed(range(GRID_SIZE)):
+            bubble = self.grid_bubbles[index]
             if not bubble:
                 continue
-            cx, cy = cell
-            cy += 1
-            bubble.set_cell_pos((cx, cy))
+            bubble.set_cell_pos((bubble.cx, bubble.cy + 1))
 
-        cy = 0
         for cx in range(GRID_WIDTH):
-            color = random.choice(self.colors)
-            x, y = get_center(cx, cy)
-            bubble = Bubble(x, y, 0, 0, color, cx, cy, board=self)
-            self.bubbles.add(bubble)
+            self.create_bubble((cx, 0), self.engine.color_at((cx, 0)))
+        self.check_game_over()
 
     def advance_preview_bubble(self):
         assert self.state is Board.RELOAD
         assert not self.preview_bubble
-        self.shoot_bubble_to_target(
-            self.second_preview_bubble,
-            (PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y),
+        self.second_preview_bubble.follow(
+            [(PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y)],
             self.speed * 2
         )
         self.trigger_state_change(Board.ADVANCING)
 
     def create_second_preview_bubble(self):
         x, y = SCREEN_WIDTH // 4, SCREEN_HEIGHT - BUBBLE_SIZE - BUBBLE_SPACE
-        color = random.choice(self.colors)
+        color = COLORS[self.engine.second_preview_color]
         self.second_preview_bubble = Bubble(x, y, 0, 0, color, -1, -1, board=self)
         self.second_preview_bubble.shimmer = Bubble.SHIMMER_MAX
         self.bubbles.add(self.second_preview_bubble)
+        self.sprites.add(self.second_preview_bubble)
 
-    def shoot_bubble(self):
+    def shoot_bubble(self, angle):
         if not self.preview_bubble:
             return
+        if math.sin(angle) >= 0:
+            # Shots must go up the board
+            return
         assert self.state is Board.READY
-        if self.stats:
-            self.stats.record_shot()
-        self.shoot_bubble_to_target(self.preview_bubble, pygame.mouse.get_pos())
+        self.engine.fire(angle)
+        _, path = self.engine.trace(angle)
+        self.preview_bubble.follow(path[1:], self.speed)
         self.current_bubble = self.preview_bubble
         self.preview_bubble = None
         self.trigger_state_change(Board.SHOOT)
 
-    def shoot_bubble_to_target(self, bubble, target, speed=None):
-        if speed is None:
-            speed = self.speed
-        x, y = bubble.x, bubble.y
-        target_x, target_y = target
-        angle = math.atan2(target_y - y, target_x - x)
-        bubble.set_speed(
-            math.cos(angle) * speed,
-            math.sin(angle) * speed
-        )
-
-    def update_colors(self):
-        assert self.state is Board.RELOAD
-        updated_colors = set()
-        for bubble in self.bubbles:
-            updated_colors.add(bubble.color)
-        self.colors = list(updated_colors)
-
     def create_tries_counter_bubble(self):
         x, y = SCREEN_WIDTH // 6, SCREEN_HEIGHT - BUBBLE_SIZE - BUBBLE_SPACE
         color = GREY
         bubble = Bubble(x, y, 0, 0, color, -1, -1, board=self)
         bubble.shimmer = Bubble.SHIMMER_MAX
         self.elements.add(bubble)
+        self.sprites.add(bubble)
 
     def init(self):
         pygame.event.clear()
-        self.step = 0
-        self.tries = -1
         self.second_preview_bubble = None
         self.preview_bubble = None
         self.current_bubble = None
-        self.refresh_tries()
+        self.removing_bubbles = []
+        self.removing_tick = 0
         self.state = Board.RELOAD
-        self.colors = list(COLORS)
         for bubble in list(self.bubbles):
             bubble.kill()
         for element in list(self.elements):
             element.kill()
-        for _ in range(INIT_HEIGHT):
-            self.advance()
+        self.grid_bubbles = [None] * GRID_SIZE
+        self.shimmer_waves.clear()
+        self.engine.reset()
+        for cell, color in self.engine.occupied():
+            self.create_bubble(cell, color)
         self.create_second_preview_bubble()
         self.create_tries_counter_bubble()
 
     def check_collisions(self):
+        # The shot lands where the path traced at fire time ends
         if not self.current_bubble:
             return
-        bubble = self.current_bubble
-        if get_distance(
-            (self.current_bubble.x, self.current_bubble.y),
-            (self.current_bubble.x, 0),
-        ) < BUBBLE_SIZE * 0.7:
-            self.handle_top_collision()
-            return
-        collided_bubbles = pygame.sprite.spritecollide(
-            bubble, self.bubbles, False, pygame.sprite.collide_circle)
-        if len(collided_bubbles) > 1:
-            self.handle_bubble_collision(collided_bubbles)
-
-    def handle_top_collision(self):
-        self.snap()
-
-    def handle_bubble_collision(self, collided_bubbles):
-        for bubble in collided_bubbles:
-            if bubble is self.current_bubble:
-                continue
-            if bubble is self.second_preview_bubble:
-                continue
-            distance = get_distance(
-                (self.current_bubble.x, self.current_bubble.y),
-                (bubble.x, bubble.y)
-            )
-            if distance < BUBBLE_SIZE * 0.7:
-                self.snap()
-                break
+        if not self.current_bubble.path:
+            self.snap()
 
     def snap(self):
         assert self.state is Board.SHOOT
         assert self.current_bubble
-        occupied = set()
-        for bubble in self.bubbles:
-            if bubble is self.current_bubble:
-                continue
-            if bubble is self.second_preview_bubble:
-                continue
-            occupied.add((bubble.cx, bubble.cy))
-
-        closest_cell = None
-        closest_distance = None
-        for cy in range(GRID_HEIGHT):
-            for cx in range(GRID_WIDTH):
-                if (cx, cy) in occupied:
-                    continue
-                x, y = get_center(cx, cy)
-                distance = get_distance((self.current_bubble.x, self.current_bubble.y), (x, y))
-                if not closest_distance or closest_distance > distance:
-                    closest_distance = distance
-                    closest_cell = (cx, cy)
-        assert closest_distance, occupied
-        cx, cy = closest_cell
+        closest_cell = self.engine.snap(self.current_bubble.x, self.current_bubble.y)
+        self.engine.place(closest_cell, COLORS.index(self.current_bubble.color))
         self.current_bubble.set_cell_pos(closest_cell)
         self.current_bubble.set_speed(0, 0)
         self.current_bubble = None
+        self.check_game_over()
         self.trigger_state_change(Board.REMOVING_BUBBLES)
         self.trigger_traverse(closest_cell)
 
     def traverse(self, start_cell):
         assert self.state is Board.REMOVING_BUBBLES
-        grid_bubbles = self.build_grid()
-        match_count = self.match_color_count(start_cell, grid_bubbles)
-        if match_count >= 3:
-            if self.stats:
-                self.stats.record_match(match_count)
-            self.kill_same_color(start_cell, grid_bubbles)
-        else:
-            self.tries -= 1
-            if self.tries < 0:
-                self.step += 1
-                self.advance()
-                self.refresh_tries()
-
-    def build_grid(self):
-        grid_bubbles = {}
-        for bubble in self.bubbles:
-            if bubble in [self.current_bubble, self.preview_bubble, self.second_preview_bubble]:
-                continue
-            grid_bubbles[(bubble.cx, bubble.cy)] = bubble
-        return grid_bubbles
-
-    def match_color_count(self, start_cell, grid_bubbles):
-        cells = [start_cell]
-        seen = {start_cell}
-        count = 0
-        while cells:
-            cell = cells.pop(0)
-            bubble = grid_bubbles[cell]
-            count += 1
-            for next_cell in neighbour_cells(cell):
-                if next_cell in seen:
-                    continue
-                next_bubble = grid_bubbles.get(next_cell)
-                if not next_bubble:
-                    continue
-                if next_bubble.color != bubble.color:
-                    continue
-                seen.add(next_cell)
-                cells.append(next_cell)
-        return count
-
-    def kill_same_color(self, start_cell, grid_bubbles):
-        assert self.state is Board.REMOVING_BUBBLES
-        cells = [start_cell]
-        seen = {start_cell}
-        while cells:
-            cell = cells.pop(0)
-            bubble = grid_bubbles[cell]
-            self.removing_bubbles.append(bubble)
-            for next_cell in neighbour_cells(cell):
-                if next_cell in seen:
-                    continue
-                next_bubble = grid_bubbles.get(next_cell)
-                if not next_bubble:
-                    continue
-                if next_bubble.color != bubble.color:
-                    continue
-                seen.add(next_cell)
-                cells.append(next_cell)
+        step = self.engine.step
+        self.start_removing(self.engine.traverse(start_cell))
+        if self.engine.step != step:
+            self.advance()
 
     def remove_disjoint(self):
         assert self.state is Board.REMOVE_DISJOINT
-        grid_bubbles = self.build_grid()
-        cells = []
-        for cell, bubble in grid_bubbles.items():
-            if not bubble:
-                continue
-            if cell[1] == 0:
-                cells.append(cell)
-
-        seen = set()
-        while cells:
-            cell = cells.pop(0)
-            if cell in seen:
-                continue
-            seen.add(cell)
-            bubble = grid_bubbles[cell]
-            for next_cell in neighbour_cells(cell):
-                if next_cell in seen:
-                    continue
-                next_bubble = grid_bubbles.get(next_cell)
-                if not next_bubble:
-                    continue
-                cells.append(next_cell)
-
-        disjoint_count = 0
-        for cell, bubble in grid_bubbles.items():
-            if not bubble:
-                continue
-            if cell not in seen:
-                self.removing_bubbles.append(bubble)
-                disjoint_count += 1
-        if disjoint_count and self.stats:
-            self.stats.record_disjoint_removal(disjoint_count)
+        self.start_removing(self.engine.remove_disjoint())
         if self.removing_bubbles:
             self.trigger_state_change(Board.REMOVING_BUBBLES)
         else:
             self.trigger_state_change(Board.RELOAD)
 
+    def start_removing(self, cells):
+        """Blow away the bubbles on ``cells`` together, staggered in order.
+
+        Large removals get their starts squeezed closer so the last bubble
+        is gone within REMOVE_TICKS however many there are.
+        """
+        self.removing_tick = 0
+        if not cells:
+            return
+        stagger = REMOVE_STAGGER
+        if len(cells) > 1:
+            spread = max(REMOVE_TICKS - Bubble.MAX_ENERGY, 0)
+            stagger = min(stagger, spread / (len(cells) - 1))
+        for i, cell in enumerate(cells):
+            self.removing_bubbles.append((i * stagger, self.bubble_at(cell)))
+
     def check_removing_bubbles(self):
         assert self.state is Board.REMOVING_BUBBLES
         if not self.removing_bubbles:
             self.trigger_state_change(Board.REMOVE_DISJOINT)
             return
-        bubble = self.removing_bubbles[0]
-        if not bubble.alive():
-            self.removing_bubbles.pop(0)
-            return
-        bubble.blow_step()
+        for start, bubble in self.removing_bubbles:
+            if start <= self.removing_tick and bubble.alive():
+                bubble.blow_step()
+        self.removing_tick += 1
+        self.removing_bubbles = [
+            (start, bubble) for start, bubble in self.removing_bubbles if bubble.alive()
+        ]
 
     def check_state(self):
         if self.state is Board.REMOVE_DISJOINT:
             self.remove_disjoint()
         elif self.state is Board.RELOAD:
-            if len(self.bubbles) == 1:  # Only second preview bubble left
+            self.engine.reload()
+            if self.engine.result == WIN:
                 self.trigger_game_over(win=True)
             else:
-                self.update_colors()
                 self.advance_preview_bubble()
         elif self.state is Board.REMOVING_BUBBLES:
             self.check_removing_bubbles()
         elif self.state is Board.ADVANCING:
-            if self.second_preview_bubble.rect.collidepoint((PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y)):
+            if not self.second_preview_bubble.path:
                 self.preview_bubble = self.second_preview_bubble
                 self.create_second_preview_bubble()
                 self.preview_bubble.x, self.preview_bubble.y = (PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y)
@@ -364,24 +296,59 @@ class Board:
                 self.preview_bubble.shimmer = Bubble.SHIMMER_MAX
                 self.trigger_state_change(Board.READY)
 
-    def start_shimmer(self, start_cell=(0, 0), same_color=False):
-        grid_bubbles = self.build_grid()
-        cells = [(start_cell, 0)]
-        seen = set()
-        while cells:
-            cell, depth = cells.pop(0)
-            seen.add(cell)
-            bubble = grid_bubbles.get(cell)
-            if bubble:
-                bubble.start_shimmer(depth * 5)
-            for next_cell in neighbour_cells(cell):
-                if next_cell in seen:
+    def interpolate(self, alpha):
+        """Place moving bubbles between their last two ticks for drawing"""
+        for bubble in self.bubbles:
+            bubble.interpolate(alpha)
+
+    def hover(self, mouse_pos):
+        """Shimmer the same-color group of the grid bubble under the mouse.
+
+        Only the bubbles on the cell nearest the mouse and its neighbours
+        can cover it, so this costs the same however many bubbles there are.
+        """
+        cx, cy = get_cell(*mouse_pos)
+        cx = min(max(cx, 0), GRID_WIDTH - 1)
+        cy = min(max(cy, 0), GRID_HEIGHT - 1)
+        index = cell_index((cx, cy))
+        for next_index in (index,) + NEIGHBOURS[index]:
+            bubble = self.grid_bubbles[next_index]
+            if bubble and bubble.rect.collidepoint(mouse_pos):
+                if not bubble.shimmer:
+                    self.start_shimmer(start_cell=(bubble.cx, bubble.cy), same_color=True)
+                return
+
+    def shimmer_wave(self, start, same_color):
+        """(index, depth) for each cell a shimmer from index ``start`` reaches."""
+        key = (start, same_color)
+        wave = self.shimmer_waves.get(key)
+        if wave is not None:
+            return wave
+        grid_bubbles = self.grid_bubbles
+        wave = [(start, 0)]
+        seen = {start}
+        for index, depth in wave:
+            bubble = grid_bubbles[index]
+            for next_index in NEIGHBOURS[index]:
+                if next_index in seen:
                     continue
-                seen.add(next_cell)
+                seen.add(next_index)
                 if same_color:
-                    next_bubble = grid_bubbles.get(next_cell)
+                    next_bubble = grid_bubbles[next_index]
                     if not next_bubble:
                         continue
                     if not bubble or next_bubble.color != bubble.color:
                         continue
-                cells.append((next_cell, depth + 1))
+                wave.append((next_index, depth + 1))
+        self.shimmer_waves[key] = wave
+        return wave
+
+    def start_shimmer(self, start_cell=(0, 0), same_color=False):
+        start = cell_index(start_cell)
+        if start is None:
+            return
+        grid_bubbles = self.grid_bubbles
+        for index, depth in self.shimmer_wave(start, same_color):
+            bubble = grid_bubbles[index]
+            if bubble:
+                bubble.start_shimmer(depth * 5)
@@ -1,15 +1,27 @@
 import logging
 import pygame
 
-from constants import (
-    BUBBLE_SIZE, SCREEN_WIDTH, GAME_OVER_GRID_HEIGHT, DEBUG,
+from constants import BUBBLE_SIZE, SCREEN_WIDTH
+from utils import (
+    SurfaceCache, border_color, highlight_color, get_center, get_distance,
 )
-from utils import load_bubble_image, get_center
 
 logger = logging.getLogger(__name__)
 
 
-class Bubble(pygame.sprite.Sprite):
+def load_bubble_image(color):
+    surface = pygame.Surface((BUBBLE_SIZE, BUBBLE_SIZE), pygame.SRCALPHA)
+    border_width = 6
+    pygame.draw.circle(surface, border_color(color), (BUBBLE_SIZE // 2, BUBBLE_SIZE // 2), BUBBLE_SIZE // 2)
+    pygame.draw.circle(surface, color, (BUBBLE_SIZE // 2, BUBBLE_SIZE // 2), BUBBLE_SIZE // 2 - border_width)
+    pygame.draw.circle(surface, highlight_color(color), (BUBBLE_SIZE // 2, BUBBLE_SIZE // 2), BUBBLE_SIZE // 5)
+    return surface
+
+
+bubble_images = SurfaceCache(load_bubble_image)
+
+
+class Bubble(pygame.sprite.DirtySprite):
     MAX_ENERGY = 10
     SHIMMER_MAX = 127
     SHIMMER_STEP = 5
@@ -18,14 +30,20 @@ class Bubble(pygame.sprite.Sprite):
         super().__init__()
         self.board = board
         self.color = color
-        self.image = load_bubble_image(color)
+        self.image = bubble_images.get(color)
         self.rect = self.image.get_rect(center=(x, y))
         self.dx = dx
         self.dy = dy
         self.x = x
         self.y = y
+        # Position before the last update, for interpolate()
+        self.prev_x = x
+        self.prev_y = y
         self.cx = cx
         self.cy = cy
+        # Remaining waypoints and speed when following a precomputed path
+        self.path = []
+        self.path_speed = 0
         self.energy = Bubble.MAX_ENERGY
         self.shimmer = 0
         self.shimmer_direction = -Bubble.SHIMMER_STEP
@@ -34,7 +52,30 @@ class Bubble(pygame.sprite.Sprite):
     def start_shimmer(self, after_ticks=0):
         self.shimmer_start_count = after_ticks
 
-    def update(self, mouse_pos):
+    def follow(self, path, speed):
+        self.path = list(path)
+        self.path_speed = speed
+        self.set_speed(0, 0)
+
+    def move_along_path(self):
+        step = self.path_speed
+        while self.path and step > 0:
+            target = self.path[0]
+            distance = get_distance((self.x, self.y), target)
+            if distance <= step:
+                self.x, self.y = target
+                self.path.pop(0)
+                step -= distance
+            else:
+                self.x += (target[0] - self.x) / distance * step
+                self.y += (target[1] - self.y) / distance * step
+                step = 0
+
+    def update(self):
+        image, topleft = self.image, self.rect.topleft
+        self.prev_x, self.prev_y = self.x, self.y
+        if self.path:
+            self.move_along_path()
         self.x = self.x + self.dx
         self.y = self.y + self.dy
         self.rect.x = self.x - BUBBLE_SIZE // 2
@@ -50,28 +91,42 @@ class Bubble(pygame.sprite.Sprite):
         if self.shimmer >= Bubble.SHIMMER_MAX:
             self.shimmer = Bubble.SHIMMER_MAX
             self.shimmer_direction = -Bubble.SHIMMER_STEP
-        if self.rect.collidepoint(mouse_pos) and not self.shimmer and self.board:
-            self.board.start_shimmer(start_cell=(self.cx, self.cy), same_color=True)
         if self.shimmer_start_count is not None:
             if self.shimmer_start_count <= 0:
                 self.shimmer_start_count = None
                 self.shimmer_direction = Bubble.SHIMMER_STEP
             else:
                 self.shimmer_start_count -= 1
-        self.image.set_alpha(255 - self.shimmer)
+        self.image = bubble_images.get(self.color, 255 - self.shimmer)
+        # Only redraw when the bubble looks different or has moved
+        if self.image is not image or self.rect.topleft != topleft:
+            self.dirty = 1
+
+    def interpolate(self, alpha):
+        """Draw the bubble ``alpha`` of the way from its previous position to its current one"""
+        if self.x == self.prev_x and self.y == self.prev_y:
+            return
+        topleft = self.rect.topleft
+        self.rect.x = self.prev_x + (self.x - self.prev_x) * alpha - BUBBLE_SIZE // 2
+        self.rect.y = self.prev_y + (self.y - self.prev_y) * alpha - BUBBLE_SIZE // 2
+        if self.rect.topleft != topleft:
+            self.dirty = 1
 
     def set_cell_pos(self, cell):
+        old_cell = (self.cx, self.cy)
         cx, cy = cell
         x, y = get_center(cx, cy)
         self.x = x
         self.y = y
         self.cx = cx
         self.cy = cy
-        if (cy + 1) >= GAME_OVER_GRID_HEIGHT:
-            if DEBUG:
-                logger.debug('cx = %s, cy = %s', cx, cy)
-            if self.board:
-                self.board.trigger_game_over(win=False)
+        if self.board:
+            self.board.index_bubble(self, old_cell)
+
+    def kill(self):
+        if self.board:
+            self.board.unindex_bubble(self)
+        super().kill()
 
     def set_speed(self, dx, dy):
         self.dx = dx
@@ -80,6 +135,7 @@ class Bubble(pygame.sprite.Sprite):
     def blow_step(self):
         self.energy -= 1
         self.y += 1.0
-        self.image.set_alpha(255.0 * self.energy / Bubble.MAX_ENERGY)
+        self.image = bubble_images.get(self.color, 255.0 * self.energy / Bubble.MAX_ENERGY)
+        self.dirty = 1
         if self.energy <= 0:
             self.kill()
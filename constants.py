@@ -1,5 +1,3 @@
-import pygame
-
 # Grid dimensions
 BUBBLE_SIZE = 80
 BUBBLE_SPACE = 16
@@ -9,6 +7,18 @@ GAME_OVER_GRID_HEIGHT = 16
 INIT_HEIGHT = 9
 SHOW_STATS = True
 
+# Game updates per second, whatever the frame rate; speeds and animation
+# lengths below count these ticks
+TICK_RATE = 120
+
+# Shot speed in pixels per tick
+SHOT_SPEED = 12
+
+# Ticks between the starts of consecutive bubbles' removal animations
+REMOVE_STAGGER = 3
+# Ticks a whole removal may take, however many bubbles it clears
+REMOVE_TICKS = 40
+
 SCREEN_WIDTH = (BUBBLE_SIZE + BUBBLE_SPACE // 2) * GRID_WIDTH + BUBBLE_SIZE // 2 + BUBBLE_SPACE
 SCREEN_HEIGHT = (BUBBLE_SIZE + BUBBLE_SPACE // 2) * GRID_HEIGHT
 
@@ -28,11 +38,6 @@ GREY = (200, 200, 200)
 PREVIEW_BUBBLE_X = SCREEN_WIDTH // 2
 PREVIEW_BUBBLE_Y = SCREEN_HEIGHT - BUBBLE_SIZE - BUBBLE_SPACE
 
-# Custom events
-GAME_OVER_EVENT = pygame.USEREVENT
-STATE_CHANGE_EVENT = pygame.USEREVENT + 1
-TRAVERSE_EVENT = pygame.USEREVENT + 2
-
 DEBUG = False
 
 # Bubble colors
@@ -6,13 +6,14 @@ import logging
 
 from constants import (
     SCREEN_WIDTH, SCREEN_HEIGHT, BUBBLE_SIZE, BUBBLE_SPACE,
+    PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y, TICK_RATE,
     BACKGROUND, SHOW_STATS, GREEN, RED, ORANGE, GREY,
-    GAME_OVER_EVENT, STATE_CHANGE_EVENT, TRAVERSE_EVENT,
     DEBUG,
 )
-from utils import draw_multiline_text
-from board import Board
+from utils import draw_multiline_text, get_angle
+from board import Board, GAME_OVER_EVENT, STATE_CHANGE_EVENT, TRAVERSE_EVENT
 from stats import GameStats, snapshot_stats_file, load_aggregate_stats
+from replay import append_replay, bubbles_replay
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +27,16 @@ BUTTON_HOVER = (130, 255, 60)
 BUTTON_TEXT_COLOR = (40, 50, 80)
 HIGHLIGHT_COLOR = ORANGE
 
+# Seconds without mouse movement before an idle READY board stops animating
+IDLE_AFTER = 20.0
+# Longest time an idle loop blocks waiting for events, in milliseconds
+IDLE_WAIT_MS = 1000
+# Seconds of game time per tick
+TICK_TIME = 1.0 / TICK_RATE
+# Most game time one frame catches up on, in seconds, so a stall does not
+# leave every later frame running ticks to catch up
+MAX_FRAME_TIME = 0.25
+
 
 def format_duration(seconds):
     if seconds is None:
@@ -37,20 +48,60 @@ def format_duration(seconds):
     return "%ds" % secs
 
 
+class TextSprite(pygame.sprite.DirtySprite):
+    """Text drawn through the board's dirty sprite group.
+
+    The surface is only re-rendered, and the sprite only redrawn, when
+    ``set_text`` is given different text. ``anchor`` holds the rect keyword
+    arguments that position it, e.g. ``{'center': (x, y)}``.
+    """
+
+    def __init__(self, font, color, line_spacing=6, **anchor):
+        super().__init__()
+        self.font = font
+        self.color = color
+        self.line_spacing = line_spacing
+        self.anchor = anchor
+        self.text = None
+        self.image = pygame.Surface((0, 0), pygame.SRCALPHA)
+        self.rect = self.image.get_rect(**anchor)
+
+    def set_text(self, text):
+        if text == self.text:
+            return
+        self.text = text
+        lines = text.split('\n') if isinstance(text, str) else text
+        line_height = self.font.get_height() + self.line_spacing
+        width = max(self.font.size(line)[0] for line in lines)
+        self.image = pygame.Surface((width, line_height * len(lines)), pygame.SRCALPHA)
+        draw_multiline_text(self.image, lines, (0, 0), self.font, self.color, self.line_spacing)
+        self.rect = self.image.get_rect(**self.anchor)
+        self.dirty = 1
+
+
+def wait_events(timeout):
+    """Block until an event arrives or ``timeout`` ms pass; return all pending events."""
+    event = pygame.event.wait(timeout)
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
+
+
 def start_new_game(board, game_stats):
     """Reset stats and record initial board state for a new game."""
     game_stats.reset()
     game_stats.record_game_start(
-        bubble_count=len(board.bubbles),
+        bubble_count=board.engine.count,
         color_count=len(board.colors),
     )
 
 
 def on_game_over(board, game_stats, win):
-    """Finalize stats and return the record. Does NOT reinitialize the board."""
+    """Finalize stats, save the replay and return the record. Does NOT reinitialize the board."""
+    append_replay(bubbles_replay(board.engine))
     return game_stats.finalize(
         win=win,
-        bubbles_remaining=len(board.bubbles),
+        bubbles_remaining=board.engine.count,
         rows_advanced=board.step,
     )
 
@@ -62,8 +113,34 @@ def on_state_change(board, from_state, to_state):
     board.state = to_state
 
 
+def step_board(board, mouse_pos):
+    """Advance the board by one tick.
+
+    The board reports state changes through the event queue, so the ones
+    queued by the tick before are applied first, as the main loop would.
+    """
+    # A shot landing queues its state change before its traverse
+    for event in pygame.event.get((STATE_CHANGE_EVENT, TRAVERSE_EVENT)):
+        if event.type == STATE_CHANGE_EVENT:
+            on_state_change(board, *(event.message))
+        else:
+            board.traverse(event.message)
+
+    if not int(random.random() * 100000):
+        board.start_shimmer()
+
+    board.hover(mouse_pos)
+    board.bubbles.update()
+    board.check_collisions()
+    board.check_state()
+
+
 def draw_game_over_screen(screen, record, aggregates, stats_font, title_font):
-    """Draw the game-over overlay. Returns the 'New Game' button rect."""
+    """Draw the game-over overlay. Returns the 'New Game' button rect.
+
+    The button itself is left to ``draw_new_game_button`` so that hovering
+    it does not redraw the whole panel.
+    """
     sw, sh = screen.get_size()
 
     # Semi-transparent overlay
@@ -215,16 +292,16 @@ def draw_game_over_screen(screen, record, aggregates, stats_font, title_font):
     button_rect.centerx = sw // 2
     button_rect.bottom = panel_y + panel_h - 30
 
-    mouse_pos = pygame.mouse.get_pos()
-    is_hover = button_rect.collidepoint(mouse_pos)
+    return button_rect
+
+
+def draw_new_game_button(screen, button_rect, is_hover, font):
     btn_color = BUTTON_HOVER if is_hover else BUTTON_COLOR
     pygame.draw.rect(screen, btn_color, button_rect, border_radius=15)
-    btn_text = label_font.render("NEW GAME", True, BUTTON_TEXT_COLOR)
+    btn_text = font.render("NEW GAME", True, BUTTON_TEXT_COLOR)
     btn_text_rect = btn_text.get_rect(center=button_rect.center)
     screen.blit(btn_text, btn_text_rect)
 
-    return button_rect
-
 
 def main():
     pygame.init()
@@ -235,7 +312,10 @@ def main():
     )
     pygame.display.set_caption("Bubbles")
     clock = pygame.time.Clock()
+    # Render rate; the game itself always advances TICK_RATE times a second
     fps = 120
+    # Game time not yet simulated, in seconds
+    lag = 0.0
 
     snapshot_stats_file()
 
@@ -250,15 +330,36 @@ def main():
 
     stats_font = pygame.font.Font(None, 36)
     tries_font = pygame.font.Font(None, 80)
+    tries_text = TextSprite(
+        tries_font, (125, 125, 125), line_spacing=0,
+        center=(SCREEN_WIDTH // 6, SCREEN_HEIGHT - BUBBLE_SIZE - BUBBLE_SPACE))
+    board.sprites.add(tries_text, layer=1)
+    stats_text = TextSprite(stats_font, TEXT_WHITE, topleft=(SCREEN_WIDTH - 300, SCREEN_HEIGHT - 200))
+    if SHOW_STATS:
+        board.sprites.add(stats_text, layer=1)
+
+    # Only the rects returned by board.sprites.draw() are pushed to the display
+    background = pygame.Surface(screen.get_size())
+    background.fill(BACKGROUND)
+    board.sprites.clear(screen, background)
+    screen.blit(background, (0, 0))
+    pygame.display.flip()
     pause = False
     running = True
 
     while running:
+        # Nothing animates on a READY board once the mouse has been still for
+        # a while, so block on the event queue instead of ticking
+        idle = pause or (
+            board.state == Board.READY and not force_refresh
+            and last_changed_time <= time.time() - IDLE_AFTER
+        )
+        events = wait_events(IDLE_WAIT_MS) if idle else pygame.event.get()
         mouse_pos = pygame.mouse.get_pos()
         if mouse_pos != last_pos:
             last_pos = mouse_pos
             last_changed_time = time.time()
-        for event in pygame.event.get():
+        for event in events:
             if event.type == pygame.QUIT:
                 running = False
             if event.type == GAME_OVER_EVENT:
@@ -266,11 +367,18 @@ def main():
                 record = on_game_over(board, game_stats, event.message)
                 aggregates = load_aggregate_stats()
 
-                # Game-over screen sub-loop
-                button_rect = pygame.Rect(0, 0, 0, 0)
+                # Game-over screen sub-loop; the panel is drawn once and only
+                # the button is redrawn when its hover state changes
+                panel = screen.copy()
+                button_rect = draw_game_over_screen(
+                    panel, record, aggregates, stats_font, tries_font)
+                is_hover = button_rect.collidepoint(pygame.mouse.get_pos())
+                screen.blit(panel, (0, 0))
+                draw_new_game_button(screen, button_rect, is_hover, stats_font)
+                pygame.display.flip()
                 waiting = True
                 while waiting and running:
-                    for ev in pygame.event.get():
+                    for ev in wait_events(IDLE_WAIT_MS):
                         if ev.type == pygame.QUIT:
                             running = False
                             waiting = False
@@ -280,16 +388,26 @@ def main():
                         if ev.type == pygame.KEYDOWN:
                             if ev.key in (pygame.K_RETURN, pygame.K_SPACE):
                                 waiting = False
-                    clock.tick(fps)
-                    button_rect = draw_game_over_screen(
-                        screen, record, aggregates, stats_font, tries_font)
-                    pygame.display.flip()
+                        if ev.type == pygame.WINDOWEXPOSED:
+                            screen.blit(panel, (0, 0))
+                            draw_new_game_button(screen, button_rect, is_hover, stats_font)
+                            pygame.display.flip()
+                    if button_rect.collidepoint(pygame.mouse.get_pos()) != is_hover:
+                        is_hover = not is_hover
+                        draw_new_game_button(screen, button_rect, is_hover, stats_font)
+                        pygame.display.update(button_rect)
 
                 # Reinitialize for next game
                 if running:
                     board.init()
                     board.start_shimmer()
                     start_new_game(board, game_stats)
+                    # The overlay covered the whole screen
+                    screen.blit(background, (0, 0))
+                    board.sprites.repaint_rect(screen.get_rect())
+                    # Time on the game-over screen is not game time
+                    clock.tick()
+                    lag = 0.0
                 break
 
             if event.type == STATE_CHANGE_EVENT:
@@ -297,43 +415,46 @@ def main():
             if event.type == TRAVERSE_EVENT:
                 board.traverse(event.message)
 
+            if event.type == pygame.WINDOWEXPOSED:
+                screen.blit(background, (0, 0))
+                board.sprites.repaint_rect(screen.get_rect())
+                force_refresh = True
             if event.type == pygame.MOUSEBUTTONDOWN:
                 if event.button == pygame.BUTTON_LEFT:
-                    board.shoot_bubble()
+                    board.shoot_bubble(get_angle((PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y), event.pos))
                 if event.button == pygame.BUTTON_RIGHT:
                     pause = not pause
 
-        clock.tick(fps)
+        elapsed = clock.tick(fps) / 1000.0
         if pause:
             continue
 
-        if board.state != Board.READY or force_refresh or last_changed_time > time.time() - 20.0:
+        if board.state != Board.READY or force_refresh or last_changed_time > time.time() - IDLE_AFTER:
             force_refresh = False
 
-            if not int(random.random() * 100000):
-                board.start_shimmer()
-
-            board.bubbles.update(mouse_pos)
-            board.check_collisions()
-            board.check_state()
-
-            screen.fill(BACKGROUND)
-            board.bubbles.draw(screen)
-            board.elements.draw(screen)
-            tries_text_color = (125, 125, 125)
-            tries_text = tries_font.render('%s' % board.tries, True, tries_text_color)
-            tries_text_rect = tries_text.get_rect(center=(SCREEN_WIDTH // 6, SCREEN_HEIGHT - BUBBLE_SIZE - BUBBLE_SPACE))
-            screen.blit(tries_text, tries_text_rect)
+            # Time spent blocked while idle is not game time
+            if not idle:
+                lag = min(lag + elapsed, MAX_FRAME_TIME)
+            while lag >= TICK_TIME and not pygame.event.peek(GAME_OVER_EVENT):
+                step_board(board, mouse_pos)
+                lag -= TICK_TIME
+            board.interpolate(min(lag / TICK_TIME, 1.0))
 
+            tries_text.set_text('%s' % board.tries)
             if SHOW_STATS:
-                stats = [
+                stats_text.set_text([
                     'board.state = %s' % board.state,
                     'board.tries = %s' % board.tries,
                     'bubbles count = %s' % len(board.bubbles),
-                ]
-                draw_multiline_text(screen, stats, (SCREEN_WIDTH - 300, SCREEN_HEIGHT - 200), stats_font)
-            pygame.display.flip()
-
+                ])
+            pygame.display.update(board.sprites.draw(screen))
+
+    # Games that ended were saved by on_game_over()
+    if board.engine.shots and not board.engine.over:
+        record = bubbles_replay(board.engine)
+        if not board.at_rest:
+            record['unfinished'] = True
+        append_replay(record)
     pygame.quit()
     sys.exit()
 
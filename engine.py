@@ -0,0 +1,394 @@
+import math
+import random
+import logging
+from array import array
+
+from constants import (
+    BUBBLE_SIZE, GRID_WIDTH, GRID_HEIGHT, GAME_OVER_GRID_HEIGHT, INIT_HEIGHT,
+    SCREEN_WIDTH, PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y,
+    TRIES, COLORS,
+)
+from utils import (
+    get_center, get_cell, get_distance, segment_centers, cell_index, index_cell,
+    NEIGHBOURS,
+)
+
+logger = logging.getLogger(__name__)
+
+WIN = 'win'
+LOSS = 'loss'
+
+# Marks a free cell in Engine.cells
+EMPTY = -1
+GRID_SIZE = GRID_WIDTH * GRID_HEIGHT
+
+
+class Engine:
+    """Bubble shooter rules without pygame.
+
+    The grid is a flat row-major ``array('b')`` of indices into ``COLORS``,
+    with ``EMPTY`` for free cells. ``board.Board`` drives the engine one step
+    at a time while it animates sprites; ``shoot()`` applies a whole shot
+    synchronously for headless play.
+
+    All randomness comes from ``self.random``, seeded by ``reset()``, and
+    ``shots`` logs the angle of every shot fired, so a game's seed and
+    shots replay it exactly.
+    """
+
+    def __init__(self, stats=None, init_height=INIT_HEIGHT, tries=TRIES):
+        self.stats = stats
+        self.init_height = init_height
+        # Number of shots before a new row advances, cycling each step
+        self.tries_schedule = list(tries)
+        self.cells = array('b', [EMPTY]) * GRID_SIZE
+        self.count = 0
+        # Flat indices of cells placed or emptied since the last
+        # remove_disjoint(), the only places bubbles can have come loose
+        self.changed_cells = set()
+        self.colors = list(range(len(COLORS)))
+        self.preview_color = None
+        self.second_preview_color = None
+        self.step = 0
+        self.tries = -1
+        self.result = None
+        self.seed = None
+        self.random = random.Random()
+        # Angle of every shot fired since reset()
+        self.shots = []
+        self.refresh_tries()
+
+    @property
+    def over(self):
+        return self.result is not None
+
+    def color_at(self, cell):
+        """Color index at ``cell``, or None when it is free or off the grid."""
+        index = cell_index(cell)
+        if index is None or self.cells[index] == EMPTY:
+            return None
+        return self.cells[index]
+
+    def occupied(self):
+        """Yield ``(cell, color)`` for every occupied cell."""
+        for index, color in enumerate(self.cells):
+            if color != EMPTY:
+                yield index_cell(index), color
+
+    def refresh_tries(self):
+        self.tries = self.tries_schedule[self.step % len(self.tries_schedule)]
+
+    def reset(self, seed=None):
+        """Fill the initial rows and pick the second preview color.
+
+        The game is seeded with ``seed``, or with a fresh random seed.
+        """
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.shots = []
+        self.cells = array('b', [EMPTY]) * GRID_SIZE
+        self.count = 0
+        self.changed_cells = set()
+        self.colors = list(range(len(COLORS)))
+        self.preview_color = None
+        self.second_preview_color = None
+        self.step = 0
+        self.result = None
+        self.refresh_tries()
+        for _ in range(self.init_height):
+            self.advance()
+        self.second_preview_color = self.random.choice(self.colors)
+
+    def new_game(self, seed=None):
+        """Reset the board and load the first preview color."""
+        self.reset(seed)
+        self.reload()
+
+    def check_game_over(self, cell):
+        if cell[1] + 1 >= GAME_OVER_GRID_HEIGHT:
+            if self.result is None:
+                logger.debug('Game over at cell %s', cell)
+            self.result = LOSS
+
+    def advance(self):
+        # Add new row on top
+        cells = self.cells
+        self.count -= GRID_WIDTH - cells[-GRID_WIDTH:].count(EMPTY)
+        cells[GRID_WIDTH:] = cells[:-GRID_WIDTH]
+        # Moving down a row swaps each row's hex offset, which can leave
+        # any bubble without a neighbour above it
+        self.changed_cells = set(range(GRID_SIZE))
+        for index in range((GAME_OVER_GRID_HEIGHT - 1) * GRID_WIDTH, GRID_SIZE):
+            if cells[index] != EMPTY:
+                self.check_game_over(index_cell(index))
+
+        for cx in range(GRID_WIDTH):
+            cells[cx] = self.random.choice(self.colors)
+        self.count += GRID_WIDTH
+
+    def update_colors(self):
+        present = set(self.cells)
+        present.add(self.second_preview_color)
+        self.colors = [color for color in range(len(COLORS)) if color in present]
+
+    def reload(self):
+        """Move the second preview color into the preview slot.
+
+        Sets ``result`` to ``WIN`` instead when the grid is empty.
+        """
+        if not self.count:
+            self.result = WIN
+            return
+        self.update_colors()
+        self.preview_color = self.second_preview_color
+        self.second_preview_color = self.random.choice(self.colors)
+
+    def fire(self, angle):
+        """Take the preview color for a shot at ``angle`` and record it."""
+        assert self.preview_color is not None
+        if math.sin(angle) >= 0:
+            # Checked before anything is recorded, so the replay log only
+            # ever holds shots that were taken
+            raise ValueError('Shot must be aimed upwards, got angle %s' % angle)
+        self.shots.append(angle)
+        if self.stats:
+            self.stats.record_shot()
+        color = self.preview_color
+        self.preview_color = None
+        return color
+
+    def trace(self, angle, checked=None):
+        """Ray-cast a shot from the preview position.
+
+        The shot bounces off the side walls and stops at the first point
+        where it touches the ceiling or a grid bubble. Returns that point
+        and the path polyline from the preview position to it, one vertex
+        per bounce. If ``checked`` is a set, the indices of the cells the
+        result depends on are added to it.
+        """
+        if math.sin(angle) >= 0:
+            raise ValueError('Shot must be aimed upwards, got angle %s' % angle)
+        reach = BUBBLE_SIZE * 0.7
+        left_wall = BUBBLE_SIZE // 2
+        right_wall = SCREEN_WIDTH - BUBBLE_SIZE // 2
+        x, y = PREVIEW_BUBBLE_X, PREVIEW_BUBBLE_Y
+        dx, dy = math.cos(angle), math.sin(angle)
+        path = [(x, y)]
+        while True:
+            # Run to the ceiling or the next wall, whichever comes first
+            t_end = (reach - y) / dy
+            bounce = False
+            if dx > 0 and (right_wall - x) / dx < t_end:
+                t_end = (right_wall - x) / dx
+                bounce = True
+            elif dx < 0 and (left_wall - x) / dx < t_end:
+                t_end = (left_wall - x) / dx
+                bounce = True
+            end = (x + dx * t_end, y + dy * t_end)
+
+            for index, (cx, cy) in segment_centers((x, y), end, reach):
+                if checked is not None:
+                    checked.add(index)
+                if self.cells[index] == EMPTY:
+                    continue
+                # First t where the shot is ``reach`` away from the center
+                along = (cx - x) * dx + (cy - y) * dy
+                discriminant = along ** 2 - ((cx - x) ** 2 + (cy - y) ** 2 - reach ** 2)
+                if discriminant < 0:
+                    continue
+                t = along - math.sqrt(discriminant)
+                if 0 <= t < t_end:
+                    t_end = t
+                    bounce = False
+                    end = (x + dx * t, y + dy * t)
+
+            path.append(end)
+            if not bounce:
+                return end, path
+            x, y = end
+            dx = -dx
+
+    def snap(self, x, y, checked=None):
+        """Return the free cell whose center is closest to ``(x, y)``.
+
+        Searches a window around ``get_cell(x, y)`` and only widens it while
+        a cell outside the window could still be closer. If ``checked`` is a
+        set, the indices of the cells the result depends on are added to it.
+        """
+        cx, cy = get_cell(x, y)
+        cx = min(max(cx, 0), GRID_WIDTH - 1)
+        cy = min(max(cy, 0), GRID_HEIGHT - 1)
+        radius = 1
+        while True:
+            top, bottom = max(cy - radius, 0), min(cy + radius, GRID_HEIGHT - 1)
+            left, right = max(cx - radius, 0), min(cx + radius, GRID_WIDTH - 1)
+            closest_cell = None
+            closest_distance = None
+            for next_cy in range(top, bottom + 1):
+                for next_cx in range(left, right + 1):
+                    if self.cells[next_cy * GRID_WIDTH + next_cx] != EMPTY:
+                        continue
+                    distance = get_distance((x, y), get_center(next_cx, next_cy))
+                    if closest_distance is None or closest_distance > distance:
+                        closest_distance = distance
+                        closest_cell = (next_cx, next_cy)
+
+            # Lower bound on the distance to any cell outside the window
+            bound = math.inf
+            if top > 0:
+                bound = min(bound, y - get_center(0, top - 1)[1])
+            if bottom < GRID_HEIGHT - 1:
+                bound = min(bound, get_center(0, bottom + 1)[1] - y)
+            if left > 0:
+                bound = min(bound, x - max(get_center(left - 1, 0)[0], get_center(left - 1, 1)[0]))
+            if right < GRID_WIDTH - 1:
+                bound = min(bound, min(get_center(right + 1, 0)[0], get_center(right + 1, 1)[0]) - x)
+
+            if closest_distance is None or closest_distance > bound:
+                if bound != math.inf:
+                    radius += 1
+                    continue
+                assert closest_cell, self.count
+            if checked is not None:
+                for next_cy in range(top, bottom + 1):
+                    checked.update(range(next_cy * GRID_WIDTH + left, next_cy * GRID_WIDTH + right + 1))
+            return closest_cell
+
+    def place(self, cell, color):
+        index = cell_index(cell)
+        assert self.cells[index] == EMPTY, cell
+        self.cells[index] = color
+        self.count += 1
+        self.changed_cells.add(index)
+        self.check_game_over(cell)
+
+    def remove(self, cells):
+        for cell in cells:
+            index = cell_index(cell)
+            self.cells[index] = EMPTY
+            self.changed_cells.add(index)
+        self.count -= len(cells)
+
+    def traverse(self, start_cell):
+        """Resolve the bubble that just landed on ``start_cell``.
+
+        Returns the cells removed by a 3+ match. A miss uses up a try and
+        advances a new row once the tries run out.
+        """
+        group = self.same_color_group(start_cell)
+        if len(group) >= 3:
+            if self.stats:
+                self.stats.record_match(len(group))
+            killed = [index_cell(index) for index in group]
+            self.remove(killed)
+            return killed
+        self.tries -= 1
+        if self.tries < 0:
+            self.step += 1
+            self.advance()
+            self.refresh_tries()
+        return []
+
+    def same_color_group(self, start_cell):
+        """Flat indices of the bubbles connected to ``start_cell`` by its color.
+
+        The list doubles as the breadth-first queue, so it comes out in
+        visiting order, nearest bubbles first.
+        """
+        grid = self.cells
+        start = cell_index(start_cell)
+        color = grid[start]
+        group = [start]
+        seen = {start}
+        for index in group:
+            for next_index in NEIGHBOURS[index]:
+                if next_index in seen:
+                    continue
+                if grid[next_index] != color:
+                    continue
+                seen.add(next_index)
+                group.append(next_index)
+        return group
+
+    def match_size(self, cell, color):
+        """Size of the group a bubble of ``color`` would join at free ``cell``."""
+        index = cell_index(cell)
+        self.cells[index] = color
+        try:
+            return len(self.same_color_group(cell))
+        finally:
+            self.cells[index] = EMPTY
+
+    def remove_disjoint(self):
+        """Remove and return the cells no longer connected to the top row.
+
+        Only bubbles at or next to ``changed_cells`` can have come loose, so
+        a search starts from each of them and stops as soon as it reaches
+        the top row or a bubble already known to hang from it. The cost
+        follows the change rather than the whole board.
+        """
+        grid = self.cells
+        starts = set(self.changed_cells)
+        for index in self.changed_cells:
+            starts.update(NEIGHBOURS[index])
+        anchored = set()
+        floating = set()
+        for start in starts:
+            if grid[start] == EMPTY or start in anchored or start in floating:
+                continue
+            group = {start}
+            stack = [start]
+            while stack:
+                index = stack.pop()
+                # Top row cells are indices 0 .. GRID_WIDTH - 1
+                if index < GRID_WIDTH or index in anchored:
+                    anchored |= group
+                    break
+                # Upper neighbours come first, so push them last to try them first
+                for next_index in reversed(NEIGHBOURS[index]):
+                    if next_index in group or grid[next_index] == EMPTY:
+                        continue
+                    group.add(next_index)
+                    stack.append(next_index)
+            else:
+                floating |= group
+
+        disjoint = [index_cell(index) for index in sorted(floating)]
+        self.remove(disjoint)
+        # A floating group falls as a whole, so no other bubble comes loose
+        self.changed_cells = set()
+        if disjoint and self.stats:
+            self.stats.record_disjoint_removal(len(disjoint))
+        return disjoint
+
+    def shoot(self, angle):
+        """Fire the preview bubble at ``angle`` and resolve the whole shot.
+
+        ``angle`` is in radians in screen coordinates, so upward shots are
+        negative. Returns a dict describing what happened.
+        """
+        # Trace first so a bad angle is rejected before the shot is spent
+        (x, y), path = self.trace(angle)
+        color = self.fire(angle)
+        cell = self.snap(x, y)
+        self.place(cell, color)
+        shot = {
+            'cell': cell,
+            'color': color,
+            'path': path,
+            'matched': [],
+            'dropped': [],
+            'advanced': False,
+        }
+        if self.over:
+            return shot
+        step = self.step
+        shot['matched'] = self.traverse(cell)
+        shot['advanced'] = self.step != step
+        if self.over:
+            return shot
+        shot['dropped'] = self.remove_disjoint()
+        self.reload()
+        return shot
@@ -0,0 +1,193 @@
+"""Play bubble shooter games headless and record their stats.
+
+Usage: python simulate.py --games 100000 --workers 8 --policy greedy
+
+Game i is seeded with --seed + i, and line i of --output holds its record
+in the format GameStats.finalize writes to stats.jsonl. Use --init-height
+and --tries to compare difficulty settings, and --columns to also write the
+records to a stats_columns file for fast aggregates over many games.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import functools
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+
+from constants import INIT_HEIGHT, TRIES
+from engine import Engine, WIN
+from stats import GameStats
+
+# Aim range in radians, kept off the horizontal
+MIN_ANGLE = -math.pi + 0.1
+MAX_ANGLE = -0.1
+GREEDY_ANGLES = 32
+# Records buffered between appends to the --columns file
+COLUMNS_CHUNK = 4096
+
+
+def random_policy(engine):
+    return random.uniform(MIN_ANGLE, MAX_ANGLE)
+
+
+GREEDY_AIMS = [MIN_ANGLE + (MAX_ANGLE - MIN_ANGLE) * i / (GREEDY_ANGLES - 1)
+               for i in range(GREEDY_ANGLES)]
+
+
+class TraceCache:
+    """Landing cells of the greedy aims, kept while the cells they hit stay put.
+
+    A shot changes only a few cells, so most of the traces from the previous
+    shot still hold and only those passing the changed cells are redone.
+    """
+    def __init__(self):
+        self.cells = None
+        # Angle -> (landing cell, indices of the cells it depends on)
+        self.traces = {}
+
+    def update(self, engine):
+        cells = bytes(engine.cells)
+        if cells == self.cells:
+            return
+        if self.cells is None:
+            self.traces.clear()
+        else:
+            changed = {i for i, (old, new) in enumerate(zip(self.cells, cells)) if old != new}
+            for angle, (_, checked) in list(self.traces.items()):
+                if not changed.isdisjoint(checked):
+                    del self.traces[angle]
+        self.cells = cells
+
+    def landing(self, engine, angle):
+        if angle not in self.traces:
+            checked = set()
+            (x, y), _ = engine.trace(angle, checked)
+            self.traces[angle] = (engine.snap(x, y, checked), checked)
+        return self.traces[angle][0]
+
+
+# One cache per engine, dropped with the engine at the end of its game
+trace_caches = weakref.WeakKeyDictionary()
+
+
+def greedy_policy(engine):
+    """Aim where the preview color joins the largest same-color group."""
+    cache = trace_caches.setdefault(engine, TraceCache())
+    cache.update(engine)
+    # Many aims land in the same cell
+    sizes = {}
+    best_angles = []
+    best_size = 0
+    for angle in GREEDY_AIMS:
+        cell = cache.landing(engine, angle)
+        if cell not in sizes:
+            sizes[cell] = engine.match_size(cell, engine.preview_color)
+        size = sizes[cell]
+        if size > best_size:
+            best_angles = [angle]
+            best_size = size
+        elif size == best_size:
+            best_angles.append(angle)
+    return random.choice(best_angles)
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+def play_game(seed, policy='random', init_height=INIT_HEIGHT, tries=TRIES):
+    """Play one seeded game to the end and return its stats record."""
+    random.seed(seed)
+    aim = POLICIES[policy]
+    game_stats = GameStats()
+    engine = Engine(stats=game_stats, init_height=init_height, tries=tries)
+    engine.reset(seed)
+    game_stats.record_game_start(bubble_count=engine.count, color_count=len(engine.colors))
+    engine.reload()
+    while not engine.over:
+        engine.shoot(aim(engine))
+    return game_stats.build_record(
+        win=engine.result == WIN,
+        bubbles_remaining=engine.count,
+        rows_advanced=engine.step,
+    )
+
+
+def parse_tries(text):
+    try:
+        return [int(value) for value in text.split(',')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected comma-separated integers: %r' % text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--init-height', type=int, default=INIT_HEIGHT)
+    parser.add_argument('--tries', type=parse_tries, default=TRIES,
+                        help='shots before each row advance, e.g. 5,4,3,2,1,0')
+    parser.add_argument('--output', default='sim_stats.jsonl')
+    parser.add_argument('--columns', help='also write the records to this stats_columns file')
+    args = parser.parse_args()
+
+    play = functools.partial(
+        play_game, policy=args.policy, init_height=args.init_height, tries=args.tries)
+    seeds = range(args.seed, args.seed + args.games)
+
+    append_columns = None
+    if args.columns:
+        from stats_columns import append_columns
+        # Like --output, the file is rewritten
+        open(args.columns, 'wb').close()
+    column_records = []
+
+    start = time.perf_counter()
+    wins = shots = rows = 0
+    executor = None
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        chunksize = max(1, args.games // (args.workers * 16))
+        records = executor.map(play, seeds, chunksize=chunksize)
+    else:
+        records = map(play, seeds)
+    try:
+        with open(args.output, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+                wins += record['result'] == 'win'
+                shots += record['shots_fired']
+                rows += record['rows_advanced']
+                if append_columns:
+                    column_records.append(record)
+                    if len(column_records) == COLUMNS_CHUNK:
+                        append_columns(column_records, args.columns)
+                        column_records = []
+        if append_columns:
+            append_columns(column_records, args.columns)
+    finally:
+        if executor:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    games = max(args.games, 1)
+    print('%d games in %.1fs (%.0f games/s, %d workers)' % (
+        args.games, elapsed, args.games / elapsed, args.workers))
+    print('win rate %.1f%%, %.1f shots and %.1f rows advanced per game' % (
+        100.0 * wins / games, shots / games, rows / games))
+    print('records written to %s' % args.output)
+    if args.columns:
+        print('and to %s' % args.columns)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,7 @@
+import os
+import sys
 import json
+import argparse
 import shutil
 import time
 from datetime import datetime
@@ -17,58 +20,294 @@ def snapshot_stats_file():
     shutil.copy2(STATS_FILE, SNAPSHOT_DIR / f"stats_{timestamp}.jsonl")
 
 
-def append_stats(record):
-    """Append a single JSON record as a line to the stats file."""
-    with open(STATS_FILE, "a") as f:
-        f.write(json.dumps(record) + "\n")
+# Aggregate key -> record field, maximised over all games
+MAX_FIELDS = {
+    "best_accuracy": "accuracy",
+    "best_max_match": "max_match_size",
+    "most_destroyed": "bubbles_destroyed",
+    "most_matches": "matches_made",
+}
+# Aggregate key -> record field, minimised over won games
+MIN_WIN_FIELDS = {
+    "best_duration": "duration_sec",
+    "best_active_time": "active_play_time_sec",
+    "fewest_shots": "shots_fired",
+    "fewest_rows": "rows_advanced",
+}
+# Record fields that are aggregated, and must be numbers
+NUMBER_FIELDS = set(MAX_FIELDS.values()) | set(MIN_WIN_FIELDS.values())
+# Fields a line must have to count as a record
+RECORD_FIELDS = NUMBER_FIELDS | {"result", "start_time", "colors_in_play"}
 
 
-def load_aggregate_stats():
-    """Load all historical records and compute aggregate stats.
+def index_path(path):
+    """Path of the summary index kept next to a stats file."""
+    return Path(path).with_suffix(".index.json")
 
-    Returns a dict with aggregate values, or None if no history exists.
+
+def empty_summary():
+    summary = {"games_played": 0, "wins": 0}
+    for key in list(MAX_FIELDS) + list(MIN_WIN_FIELDS):
+        summary[key] = None
+    # Bytes of the stats file covered so far and the last complete line in
+    # them, used to check the index still matches the file
+    summary["size"] = 0
+    summary["last_line"] = ""
+    return summary
+
+
+def update_summary(summary, record):
+    """Fold one record into the running summary."""
+    summary["games_played"] += 1
+    for key, field in MAX_FIELDS.items():
+        if summary[key] is None or record[field] > summary[key]:
+            summary[key] = record[field]
+    if record["result"] == "win":
+        summary["wins"] += 1
+        for key, field in MIN_WIN_FIELDS.items():
+            if summary[key] is None or record[field] < summary[key]:
+                summary[key] = record[field]
+
+
+def iter_lines(path, offset=0):
+    """Yield ``(end_offset, line)`` for each line from byte ``offset``.
+
+    The last line is yielded even without a newline.
     """
-    if not STATS_FILE.exists():
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for raw in f:
+            offset += len(raw)
+            # Undecodable bytes survive as surrogates, so the line still
+            # encodes back to what is in the file
+            yield offset, raw.decode(errors="surrogateescape")
+
+
+def parse_record(line):
+    """Parse one stats line, or return None for a blank or corrupt one."""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        line.encode()
+        record = json.loads(line)
+    except (UnicodeEncodeError, json.JSONDecodeError):
         return None
+    if not isinstance(record, dict) or not RECORD_FIELDS <= record.keys():
+        return None
+    for field in NUMBER_FIELDS:
+        if isinstance(record[field], bool) or not isinstance(record[field], (int, float)):
+            return None
+    if not isinstance(record["start_time"], str) or not isinstance(record["colors_in_play"], int):
+        return None
+    return record
+
+
+def read_summary(path, summary, offset=0):
+    """Fold the records from byte ``offset`` of ``path`` into ``summary``.
+
+    A last line without a newline that doesn't parse may be a record still
+    being appended, so it is left for the next read.
+    """
+    for end, line in iter_lines(path, offset):
+        record = parse_record(line)
+        if record is None and not line.endswith("\n"):
+            break
+        offset = end
+        summary["last_line"] = line
+        if record is not None:
+            update_summary(summary, record)
+    summary["size"] = offset
+    return summary
+
+
+def iter_records(path=None):
+    """Yield the records of a stats file one at a time, skipping bad lines."""
+    path = Path(path or STATS_FILE)
+    if not path.exists():
+        return
+    for _, line in iter_lines(path):
+        record = parse_record(line)
+        if record is not None:
+            yield record
+
 
-    records = []
-    with open(STATS_FILE, "r") as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            try:
-                records.append(json.loads(line))
-            except json.JSONDecodeError:
-                continue
-
-    if not records:
+def started_between(start=None, end=None):
+    """Filter for games started at or after ``start`` and before ``end``.
+
+    Either bound may be None, a datetime or an ISO date or datetime string.
+    """
+    # ISO timestamps of one format sort as strings
+    if start is not None:
+        start = _as_datetime(start).isoformat()
+    if end is not None:
+        end = _as_datetime(end).isoformat()
+
+    def matches(record):
+        started = record["start_time"]
+        return (start is None or started >= start) and (end is None or started < end)
+    return matches
+
+
+def result_is(result):
+    """Filter for games that ended in ``result``, "win" or "loss"."""
+    return lambda record: record["result"] == result
+
+
+def colors_in_play(*counts):
+    """Filter for games that started with one of the given color counts."""
+    counts = set(counts)
+    return lambda record: record["colors_in_play"] in counts
+
+
+def filter_records(records, *filters):
+    """Yield the records that pass every filter."""
+    for record in records:
+        if all(matches(record) for matches in filters):
+            yield record
+
+
+def _as_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def index_matches(path, summary):
+    """Check that the first ``summary["size"]`` bytes of ``path`` are the ones indexed.
+
+    Only the file size and the last indexed line are compared, which
+    catches the file being truncated or rewritten.
+    """
+    size = summary["size"]
+    if not size:
+        return True
+    tail = summary["last_line"].encode(errors="surrogateescape")
+    if path.stat().st_size < size or len(tail) > size:
+        return False
+    with open(path, "rb") as f:
+        f.seek(size - len(tail))
+        return f.read(len(tail)) == tail
+
+
+def load_summary(path):
+    """Load the index for ``path``, or None if it is missing or unreadable."""
+    try:
+        with open(index_path(path), "r") as f:
+            summary = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(summary, dict) or set(summary) != set(empty_summary()):
         return None
+    return summary
 
-    wins = [r for r in records if r["result"] == "win"]
 
-    agg = {
-        "games_played": len(records),
-        "wins": len(wins),
-        "losses": len(records) - len(wins),
-        "win_rate": len(wins) / len(records),
-        "best_accuracy": max(r["accuracy"] for r in records),
-        "best_max_match": max(r["max_match_size"] for r in records),
-        "most_destroyed": max(r["bubbles_destroyed"] for r in records),
-        "most_matches": max(r["matches_made"] for r in records),
-    }
+def save_summary(path, summary):
+    tmp_path = index_path(path).with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(summary, f)
+    os.replace(tmp_path, index_path(path))
 
-    if wins:
-        agg["best_duration"] = min(r["duration_sec"] for r in wins)
-        agg["best_active_time"] = min(r["active_play_time_sec"] for r in wins)
-        agg["fewest_shots"] = min(r["shots_fired"] for r in wins)
-        agg["fewest_rows"] = min(r["rows_advanced"] for r in wins)
-    else:
-        agg["best_duration"] = None
-        agg["best_active_time"] = None
-        agg["fewest_shots"] = None
-        agg["fewest_rows"] = None
 
+def rebuild_stats_index(path=None):
+    """Rebuild the summary index by reading the whole stats file.
+
+    Returns the new summary.
+    """
+    path = Path(path or STATS_FILE)
+    summary = empty_summary()
+    if path.exists():
+        read_summary(path, summary)
+    save_summary(path, summary)
+    return summary
+
+
+def update_stats_index(path=None):
+    """Bring the summary index up to date with the stats file and return it.
+
+    Lines appended since the index was written are read from where it left
+    off; an index that no longer matches the file is rebuilt.
+    """
+    path = Path(path or STATS_FILE)
+    summary = load_summary(path)
+    if summary is None or not index_matches(path, summary):
+        return rebuild_stats_index(path)
+    if path.stat().st_size != summary["size"]:
+        read_summary(path, summary, summary["size"])
+        save_summary(path, summary)
+    return summary
+
+
+def ends_with_newline(path):
+    with open(path, "rb") as f:
+        f.seek(-1, os.SEEK_END)
+        return f.read(1) == b"\n"
+
+
+def append_stats(record, path=None):
+    """Append a single JSON record as a line to the stats file.
+
+    Also folds it into the summary index when the index is current.
+    """
+    path = Path(path or STATS_FILE)
+    size = path.stat().st_size if path.exists() else 0
+    summary = load_summary(path) if size else empty_summary()
+    if summary is not None and (summary["size"] != size or not index_matches(path, summary)):
+        # Stale index; load_aggregate_stats() will catch it up
+        summary = None
+    line = json.dumps(record) + "\n"
+    with open(path, "a") as f:
+        if size and not ends_with_newline(path):
+            # Don't run on from a last line that has no newline
+            f.write("\n")
+        f.write(line)
+    if summary is not None:
+        update_summary(summary, record)
+        summary["size"] = path.stat().st_size
+        summary["last_line"] = line
+        save_summary(path, summary)
+
+
+def load_aggregate_stats(path=None):
+    """Compute aggregate stats over all historical records.
+
+    Reads the summary index, catching it up with the stats file first.
+    Returns a dict with aggregate values, or None if no history exists.
+    """
+    path = Path(path or STATS_FILE)
+    if not path.exists():
+        return None
+
+    return summary_aggregates(update_stats_index(path))
+
+
+def aggregate_records(records):
+    """Aggregate stats over any iterable of records in a single pass.
+
+    Takes constant memory, so it works on a lazy ``filter_records`` query
+    over a history of any size. Returns None when there are no records.
+    """
+    summary = empty_summary()
+    for record in records:
+        update_summary(summary, record)
+    return summary_aggregates(summary)
+
+
+def summary_aggregates(summary):
+    """The aggregates dict of a summary, or None if it has no games."""
+    if not summary["games_played"]:
+        return None
+
+    games = summary["games_played"]
+    wins = summary["wins"]
+    agg = {
+        "games_played": games,
+        "wins": wins,
+        "losses": games - wins,
+        "win_rate": wins / games,
+    }
+    for key in list(MAX_FIELDS) + list(MIN_WIN_FIELDS):
+        agg[key] = summary[key]
     return agg
 
 
@@ -103,7 +342,7 @@ class GameStats:
         self.shot_timestamps.append(time.time())
 
     def record_match(self, match_size):
-        """Called from kill_same_color() with the count of matched bubbles."""
+        """Called from Engine.traverse() with the count of matched bubbles."""
         self.shots_hit += 1
         self.matches_made += 1
         self.bubbles_destroyed_by_match += match_size
@@ -115,6 +354,12 @@ class GameStats:
 
     def finalize(self, win, bubbles_remaining, rows_advanced):
         """Called on game over. Builds the stats dict and appends to file."""
+        record = self.build_record(win, bubbles_remaining, rows_advanced)
+        append_stats(record)
+        return record
+
+    def build_record(self, win, bubbles_remaining, rows_advanced):
+        """Build the stats dict for a finished game without saving it."""
         end_time = datetime.now()
         end_ts = time.time()
         duration = (end_time - self.start_time).total_seconds()
@@ -141,11 +386,43 @@ class GameStats:
             "initial_bubble_count": self.initial_bubble_count,
             "colors_in_play": self.colors_in_play,
         }
-
-        append_stats(record)
         return record
 
     def _calc_active_time(self, end_ts):
         cap = self.ACTIVE_TIME_CAP
         timestamps = [self.start_ts] + self.shot_timestamps + [end_ts]
         return sum(min(timestamps[i] - timestamps[i - 1], cap) for i in range(1, len(timestamps)))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the summary index of a stats file, or aggregate the games matching "
+                    "any filters given.")
+    parser.add_argument("path", nargs="?", default=STATS_FILE, type=Path)
+    parser.add_argument("--since", help="games started on or after this ISO date or time")
+    parser.add_argument("--until", help="games started before this ISO date or time")
+    parser.add_argument("--result", choices=["win", "loss"])
+    parser.add_argument("--colors", type=int, nargs="+", help="colors in play at the start")
+    args = parser.parse_args()
+
+    filters = []
+    if args.since or args.until:
+        filters.append(started_between(args.since, args.until))
+    if args.result:
+        filters.append(result_is(args.result))
+    if args.colors:
+        filters.append(colors_in_play(*args.colors))
+
+    if not filters:
+        old_summary = load_summary(args.path)
+        summary = rebuild_stats_index(args.path)
+        stale = old_summary is not None and summary != old_summary
+        print("%s: %d games indexed%s" % (args.path, summary["games_played"], ", index was stale" if stale else ""))
+        return 0
+    agg = aggregate_records(filter_records(iter_records(args.path), *filters))
+    print(json.dumps(agg, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
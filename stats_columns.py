@@ -0,0 +1,204 @@
+"""Compact binary store for game stats records, read through a memory map.
+
+Usage: python stats_columns.py [stats.jsonl] [stats.cols]
+
+Converts a stats.jsonl file and prints the aggregates of the result.
+
+Each record from GameStats.build_record takes one fixed-width row of
+RECORD_DTYPE, one column per field, after a short header. Rows are only
+ever appended, and reading maps the file as a NumPy structured array, so
+aggregates over millions of games are a few vectorised column scans.
+"""
+import sys
+import json
+import time
+import struct
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+from stats import STATS_FILE, MAX_FIELDS, MIN_WIN_FIELDS, iter_records
+
+COLUMNS_FILE = STATS_FILE.with_suffix(".cols")
+
+MAGIC = b"MRBLSTAT"
+VERSION = 1
+# Magic, version and row size
+HEADER = struct.Struct("<8sII")
+
+# Record field -> column type. Times are naive datetimes stored as
+# microseconds since 1970-01-01 so they convert back exactly, and the
+# result is stored as a win flag.
+COLUMNS = {
+    "start_time": np.int64,
+    "end_time": np.int64,
+    "result": np.bool_,
+    "duration_sec": np.float64,
+    "active_play_time_sec": np.float64,
+    "shots_fired": np.int32,
+    "shots_hit": np.int32,
+    "shots_missed": np.int32,
+    "accuracy": np.float64,
+    "bubbles_destroyed": np.int32,
+    "bubbles_destroyed_by_match": np.int32,
+    "bubbles_destroyed_by_disjoint": np.int32,
+    "max_match_size": np.int32,
+    "matches_made": np.int32,
+    "rows_advanced": np.int32,
+    "bubbles_remaining": np.int32,
+    "initial_bubble_count": np.int32,
+    "colors_in_play": np.int32,
+}
+RECORD_DTYPE = np.dtype(list(COLUMNS.items()))
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+
+
+def encode_value(field, value):
+    if field.endswith("_time"):
+        return (datetime.fromisoformat(value) - EPOCH) // MICROSECOND
+    if field == "result":
+        return value == "win"
+    return value
+
+
+def decode_value(field, value):
+    if field.endswith("_time"):
+        return (EPOCH + int(value) * MICROSECOND).isoformat()
+    if field == "result":
+        return "win" if value else "loss"
+    return value.item()
+
+
+def encode_records(records):
+    """Rows of RECORD_DTYPE for a list of stats records."""
+    rows = np.zeros(len(records), dtype=RECORD_DTYPE)
+    for field in COLUMNS:
+        rows[field] = [encode_value(field, record[field]) for record in records]
+    return rows
+
+
+def decode_row(row):
+    """Stats record dict for one row, as GameStats.build_record returns it."""
+    return {field: decode_value(field, row[field]) for field in COLUMNS}
+
+
+def append_rows(rows, path=None):
+    """Append rows of RECORD_DTYPE to a column file, creating it if needed."""
+    path = Path(path or COLUMNS_FILE)
+    rows = np.asarray(rows, dtype=RECORD_DTYPE)
+    with open(path, "ab") as f:
+        size = f.tell()
+        if size < HEADER.size:
+            # New, or the header itself was cut short
+            f.truncate(0)
+            f.write(HEADER.pack(MAGIC, VERSION, RECORD_DTYPE.itemsize))
+        elif (size - HEADER.size) % RECORD_DTYPE.itemsize:
+            # Drop a row left half written by an interrupted append
+            f.truncate(size - (size - HEADER.size) % RECORD_DTYPE.itemsize)
+        f.write(rows.tobytes())
+
+
+def append_columns(records, path=None):
+    """Append stats records to a column file."""
+    append_rows(encode_records(records), path)
+
+
+def load_columns(path=None):
+    """Memory-map a column file as a read-only structured array.
+
+    Indexing it by field name gives that column, e.g. ``data["shots_fired"]``.
+    A file too short to hold the header, as left by a writer interrupted
+    before its first append, loads as no rows.
+    """
+    path = Path(path or COLUMNS_FILE)
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    magic, version, row_size = HEADER.unpack(header)
+    if magic != MAGIC:
+        raise ValueError("%s is not a stats column file" % path)
+    if version != VERSION or row_size != RECORD_DTYPE.itemsize:
+        raise ValueError("%s is a stats column file of another version, expected version %d" % (path, VERSION))
+    count = (path.stat().st_size - HEADER.size) // row_size
+    if not count:
+        return np.zeros(0, dtype=RECORD_DTYPE)
+    return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER.size, shape=(count,))
+
+
+def aggregate_columns(data):
+    """Aggregates over loaded columns, like stats.load_aggregate_stats()."""
+    games = len(data)
+    if not games:
+        return None
+    won = data["result"]
+    wins = int(np.count_nonzero(won))
+    agg = {
+        "games_played": games,
+        "wins": wins,
+        "losses": games - wins,
+        "win_rate": wins / games,
+    }
+    for key, field in MAX_FIELDS.items():
+        agg[key] = data[field].max().item()
+    for key, field in MIN_WIN_FIELDS.items():
+        agg[key] = data[field][won].min().item() if wins else None
+    return agg
+
+
+def histogram(data, field, bins=20):
+    """Counts and bin edges of a column.
+
+    Integer columns are counted per value, from 0 up to their maximum, with
+    ``range(len(counts))`` as the edges; float columns use ``bins`` even bins.
+    """
+    column = data[field]
+    if np.issubdtype(column.dtype, np.integer):
+        counts = np.bincount(column)
+        return counts, np.arange(len(counts) + 1)
+    return np.histogram(column, bins=bins)
+
+
+def convert(jsonl_path=None, path=None, chunk_size=65536):
+    """Append every record of a stats.jsonl file to a column file.
+
+    Reads through stats.iter_records, so the same lines are skipped as
+    everywhere else. Returns the number of records converted.
+    """
+    count = 0
+    chunk = []
+    for record in iter_records(jsonl_path):
+        chunk.append(record)
+        if len(chunk) == chunk_size:
+            append_columns(chunk, path)
+            count += len(chunk)
+            chunk = []
+    if chunk or not count:
+        append_columns(chunk, path)
+        count += len(chunk)
+    return count
+
+
+def main():
+    jsonl_path = Path(sys.argv[1] if len(sys.argv) > 1 else STATS_FILE)
+    path = Path(sys.argv[2] if len(sys.argv) > 2 else jsonl_path.with_suffix(".cols"))
+    if not jsonl_path.exists():
+        print("%s does not exist" % jsonl_path)
+        return 1
+    if path.exists():
+        print("%s already exists; remove it to convert again" % path)
+        return 1
+    start = time.perf_counter()
+    count = convert(jsonl_path, path)
+    print("%d records converted to %s in %.2fs" % (count, path, time.perf_counter() - start))
+    start = time.perf_counter()
+    agg = aggregate_columns(load_columns(path))
+    print("aggregates in %.2f ms: %s" % ((time.perf_counter() - start) * 1e3, json.dumps(agg)))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
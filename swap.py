@@ -2,14 +2,13 @@ import pygame
 import sys
 import random
 
-# Initialize Pygame
-pygame.init()
+from utils import SurfaceCache
+from swap_engine import GRID_WIDTH, GRID_HEIGHT, SwapEngine
+from replay import append_replay, swap_replay
 
 # Constants
 BLOCK_SIZE = 50
 BLOCK_SPACE = 4
-GRID_WIDTH = 17
-GRID_HEIGHT = 17
 SCREEN_WIDTH = GRID_WIDTH * (BLOCK_SIZE + BLOCK_SPACE) + BLOCK_SPACE
 SCREEN_HEIGHT = GRID_HEIGHT * (BLOCK_SIZE + BLOCK_SPACE) + BLOCK_SPACE + 100  # extra for score
 
@@ -24,15 +23,6 @@ ORANGE = (254, 183, 42)
 
 colors = [PINK, RED, PURPLE, BLUE, GREEN, ORANGE]
 
-# Setup the display
-screen = pygame.display.set_mode(
-    (SCREEN_WIDTH, SCREEN_HEIGHT),
-    pygame.HWSURFACE | pygame.DOUBLEBUF
-)
-pygame.display.set_caption("Swap")
-clock = pygame.time.Clock()
-fps = 60
-
 
 def border_color(color):
     """Darken color for block border"""
@@ -60,6 +50,9 @@ def load_block_image(color):
     return surface
 
 
+block_images = SurfaceCache(load_block_image)
+
+
 def get_center(cx, cy):
     """Get pixel coordinates for grid cell (cx, cy)"""
     x = cx * (BLOCK_SIZE + BLOCK_SPACE) + BLOCK_SIZE // 2 + BLOCK_SPACE
@@ -93,8 +86,8 @@ class Block(pygame.sprite.Sprite):
         self.x, self.y = get_center(cx, cy)
         self.target_x = self.x
         self.target_y = self.y
-        self.base_image = load_block_image(color)
-        self.image = self.base_image.copy()
+        self.base_image = block_images.get(color)
+        self.image = self.base_image
         self.rect = self.image.get_rect(center=(self.x, self.y))
         self.selected = False
         self.swapping = False
@@ -182,9 +175,8 @@ class Block(pygame.sprite.Sprite):
                 self.shimmer_direction = Block.SHIMMER_STEP
         
         # Apply shimmer alpha
-        if not self.removing and self.shimmer > 0:
-            self.image = self.base_image.copy()
-            self.image.set_alpha(255 - self.shimmer)
+        if not self.removing:
+            self.image = block_images.get(self.color, 255 - self.shimmer)
         
         self.rect.center = (int(self.x), int(self.y))
     
@@ -214,7 +206,11 @@ class Block(pygame.sprite.Sprite):
 
 
 class Board:
-    """Game board managing the grid of blocks"""
+    """Game board managing the grid of blocks
+    
+    The match-3 rules live in swap_engine.SwapEngine; the board animates
+    its blocks to follow the engine one step at a time.
+    """
     
     # States
     IDLE = 'IDLE'
@@ -224,6 +220,7 @@ class Board:
     FALLING = 'FALLING'
     
     def __init__(self):
+        self.engine = SwapEngine(color_count=len(colors))
         self.blocks = pygame.sprite.Group()
         self.grid = {}  # (cx, cy) -> Block
         self.selected_block = None
@@ -233,12 +230,22 @@ class Board:
         self.falling_blocks = []   # Blocks currently falling
         self.last_swapped = []  # Track last swapped blocks for invalid swap reversal
         self.is_swap_back = False  # Flag to track if current swap is a reversal
-        self.score = 0
-        self.combo = 0  # Chain combo multiplier
         self.color_bomb_active = False  # Color bomb power-up mode
         self.row_bomb_active = False    # Row clear power-up mode
         self.col_bomb_active = False    # Column clear power-up mode
     
+    @property
+    def score(self):
+        return self.engine.score
+    
+    @property
+    def combo(self):
+        return self.engine.combo
+    
+    @property
+    def valid_moves(self):
+        return self.engine.valid_moves
+    
     def init(self):
         """Initialize the board with random blocks"""
         # Clear existing blocks
@@ -252,43 +259,36 @@ class Board:
         self.falling_blocks = []
         self.last_swapped = []
         self.is_swap_back = False
-        self.score = 0
-        self.combo = 0
         self.color_bomb_active = False
         self.row_bomb_active = False
         self.col_bomb_active = False
         
-        # Fill grid with random blocks, avoiding initial matches
+        # One block per cell of the engine's new grid
+        self.engine.reset()
         for cy in range(GRID_HEIGHT):
             for cx in range(GRID_WIDTH):
-                color = self.get_safe_color(cx, cy)
-                block = Block(color, cx, cy)
+                block = Block(colors[self.engine.color_at(cx, cy)], cx, cy)
                 self.blocks.add(block)
-                self.grid[(cx, cy)] = block
-    
-    def get_safe_color(self, cx, cy):
-        """Get a color that won't create a match at (cx, cy)"""
-        forbidden = set()
-        
-        # Check horizontal - if two blocks to the left have same color, forbid it
-        if cx >= 2:
-            left1 = self.grid.get((cx - 1, cy))
-            left2 = self.grid.get((cx - 2, cy))
-            if left1 and left2 and left1.color == left2.color:
-                forbidden.add(left1.color)
-        
-        # Check vertical - if two blocks above have same color, forbid it
-        if cy >= 2:
-            up1 = self.grid.get((cx, cy - 1))
-            up2 = self.grid.get((cx, cy - 2))
-            if up1 and up2 and up1.color == up2.color:
-                forbidden.add(up1.color)
-        
-        # Choose from allowed colors
-        allowed = [c for c in colors if c not in forbidden]
-        if not allowed:
-            allowed = colors  # Fallback if all forbidden (shouldn't happen)
-        return random.choice(allowed)
+                self.set_block(cx, cy, block)
+    
+    def set_block(self, cx, cy, block):
+        """Put block (or None) at grid position"""
+        self.grid[(cx, cy)] = block
+    
+    def sync_colors(self):
+        """Recolor blocks after the engine reshuffled a deadlocked grid"""
+        for (cx, cy), block in self.grid.items():
+            color = colors[self.engine.color_at(cx, cy)]
+            if block.color != color:
+                block.color = color
+                block.base_image = block_images.get(color)
+    
+    def show_hint(self):
+        """Shimmer the two blocks of a valid move"""
+        if self.state != Board.IDLE or not self.valid_moves:
+            return
+        for cx, cy in random.choice(self.valid_moves):
+            self.grid[(cx, cy)].shimmer_direction = Block.SHIMMER_STEP
     
     def get_block_at(self, cx, cy):
         """Get block at grid position"""
@@ -314,10 +314,11 @@ class Board:
         block2.animate_to(block1.x, block1.y)
         
         # Swap grid positions
+        self.engine.player_swap((block1.cx, block1.cy), (block2.cx, block2.cy))
         block1.cx, block2.cx = block2.cx, block1.cx
         block1.cy, block2.cy = block2.cy, block1.cy
-        self.grid[(block1.cx, block1.cy)] = block1
-        self.grid[(block2.cx, block2.cy)] = block2
+        self.set_block(block1.cx, block1.cy, block1)
+        self.set_block(block2.cx, block2.cy, block2)
         
         # Clear selection
         if self.selected_block:
@@ -386,10 +387,7 @@ class Board:
             self.selected_block = None
         
         # Find all blocks of the target color
-        matches = set()
-        for (cx, cy), block in self.grid.items():
-            if block and block.color == target_color:
-                matches.add((cx, cy))
+        matches = self.engine.bomb_cells('color', colors.index(target_color))
         
         if matches:
             self.remove_matches(matches)
@@ -404,10 +402,7 @@ class Board:
             self.selected_block = None
         
         # Find all blocks in the row
-        matches = set()
-        for cx in range(GRID_WIDTH):
-            if self.grid.get((cx, target_row)):
-                matches.add((cx, target_row))
+        matches = self.engine.bomb_cells('row', target_row)
         
         if matches:
             self.remove_matches(matches)
@@ -422,10 +417,7 @@ class Board:
             self.selected_block = None
         
         # Find all blocks in the column
-        matches = set()
-        for cy in range(GRID_HEIGHT):
-            if self.grid.get((target_col, cy)):
-                matches.add((target_col, cy))
+        matches = self.engine.bomb_cells('col', target_col)
         
         if matches:
             self.remove_matches(matches)
@@ -503,54 +495,6 @@ class Board:
                 self.swapping_blocks = []
                 self.state = Board.CHECKING
     
-    def find_matches(self):
-        """Find all matching blocks (3+ in a row horizontally or vertically)"""
-        matches = set()
-        
-        # Check horizontal matches
-        for cy in range(GRID_HEIGHT):
-            run_start = 0
-            run_color = None
-            for cx in range(GRID_WIDTH + 1):
-                block = self.grid.get((cx, cy))
-                current_color = block.color if block else None
-                
-                if current_color == run_color and current_color is not None:
-                    # Continue the run
-                    pass
-                else:
-                    # End of run - check if it's a match (3+)
-                    run_length = cx - run_start
-                    if run_length >= 3 and run_color is not None:
-                        for x in range(run_start, cx):
-                            matches.add((x, cy))
-                    # Start new run
-                    run_start = cx
-                    run_color = current_color
-        
-        # Check vertical matches
-        for cx in range(GRID_WIDTH):
-            run_start = 0
-            run_color = None
-            for cy in range(GRID_HEIGHT + 1):
-                block = self.grid.get((cx, cy))
-                current_color = block.color if block else None
-                
-                if current_color == run_color and current_color is not None:
-                    # Continue the run
-                    pass
-                else:
-                    # End of run - check if it's a match (3+)
-                    run_length = cy - run_start
-                    if run_length >= 3 and run_color is not None:
-                        for y in range(run_start, cy):
-                            matches.add((cx, y))
-                    # Start new run
-                    run_start = cy
-                    run_color = current_color
-        
-        return matches
-    
     def remove_matches(self, matches):
         """Start removal animation for matched blocks"""
         self.removing_blocks = []
@@ -559,12 +503,10 @@ class Board:
             if block:
                 block.start_removal()
                 self.removing_blocks.append(block)
-                self.grid[(cx, cy)] = None
+                self.set_block(cx, cy, None)
         
         # Update score with combo multiplier
-        self.combo += 1
-        points = len(matches) * 10 * self.combo
-        self.score += points
+        self.engine.remove(matches)
         
         self.state = Board.REMOVING
     
@@ -582,59 +524,31 @@ class Board:
     
     def apply_gravity_and_refill(self):
         """
-        Make blocks fall down to fill empty spaces, one step at a time.
-        - Start from bottom row, check for empty cells
-        - If empty, pull block from cell above
-        - If top cell is empty, spawn new random block
-        - Repeat until no empty cells
+        Make blocks fall straight to their final rows and refill the grid.
+        - The engine compacts each column with empty cells in one pass
+        - New blocks stack above the grid, one per empty cell, and fall in
+          behind the existing ones
         """
         self.falling_blocks = []
         
-        # Process each column
-        for cx in range(GRID_WIDTH):
-            # Start from bottom row, go up
-            for cy in range(GRID_HEIGHT - 1, -1, -1):
-                if self.grid.get((cx, cy)) is None:
-                    # Empty cell - try to pull block from above
-                    if cy > 0:
-                        # Look for a block above
-                        above_block = self.grid.get((cx, cy - 1))
-                        if above_block:
-                            # Pull block down
-                            self.grid[(cx, cy - 1)] = None
-                            self.grid[(cx, cy)] = above_block
-                            above_block.cy = cy
-                            target_x, target_y = get_center(cx, cy)
-                            above_block.target_x = target_x
-                            above_block.start_falling(target_y)
-                            self.falling_blocks.append(above_block)
-                    
-                    # If this is the top row (cy == 0) and it's empty, spawn new block
-                    if cy == 0 and self.grid.get((cx, 0)) is None:
-                        color = random.choice(colors)
-                        # Create block above the grid
-                        block = Block(color, cx, -1)
-                        start_x, start_y = get_center(cx, -1)
-                        block.x = start_x
-                        block.y = start_y
-                        # Set target to top row
-                        block.cx = cx
-                        block.cy = 0
-                        target_x, target_y = get_center(cx, 0)
-                        block.target_x = target_x
-                        block.start_falling(target_y)
-                        
-                        self.blocks.add(block)
-                        self.grid[(cx, 0)] = block
-                        self.falling_blocks.append(block)
+        # Moves come bottom up, so a block's new cell is already vacated
+        for cx, old_cy, cy in self.engine.gravity():
+            if old_cy >= 0:
+                block = self.grid[(cx, old_cy)]
+                self.set_block(cx, old_cy, None)
+            else:
+                block = Block(colors[self.engine.color_at(cx, cy)], cx, old_cy)
+                self.blocks.add(block)
+            block.cy = cy
+            self.set_block(cx, cy, block)
+            target_x, target_y = get_center(cx, cy)
+            block.target_x = target_x
+            block.start_falling(target_y)
+            self.falling_blocks.append(block)
     
     def has_empty_cells(self):
         """Check if there are any empty cells in the grid"""
-        for cy in range(GRID_HEIGHT):
-            for cx in range(GRID_WIDTH):
-                if self.grid.get((cx, cy)) is None:
-                    return True
-        return False
+        return self.engine.has_empty_cells()
     
     def check_falling_complete(self):
         """Check if all falling animations are complete"""
@@ -670,17 +584,18 @@ class Board:
             block2.animate_to(block1.x, block1.y)
             
             # Swap grid positions back
+            self.engine.swap_back((block1.cx, block1.cy), (block2.cx, block2.cy))
             block1.cx, block2.cx = block2.cx, block1.cx
             block1.cy, block2.cy = block2.cy, block1.cy
-            self.grid[(block1.cx, block1.cy)] = block1
-            self.grid[(block2.cx, block2.cy)] = block2
+            self.set_block(block1.cx, block1.cy, block1)
+            self.set_block(block2.cx, block2.cy, block2)
             
             self.last_swapped = []
     
     def check_state(self):
         """Main state machine logic"""
         if self.state == Board.CHECKING:
-            matches = self.find_matches()
+            matches = self.engine.check()
             if matches:
                 self.remove_matches(matches)
                 self.last_swapped = []  # Valid move, clear swap history
@@ -690,7 +605,8 @@ class Board:
                     self.swap_back()
                 else:
                     # Reset combo when chain ends
-                    self.combo = 0
+                    self.engine.end_cascade()
+                    self.sync_colors()
                     self.state = Board.IDLE
         
         elif self.state == Board.FALLING:
@@ -718,10 +634,6 @@ class Board:
         self.check_state()
 
 
-# Fonts
-score_font = pygame.font.Font(None, 48)
-combo_font = pygame.font.Font(None, 36)
-
 # Power-up icons
 ICON_SIZE = 60
 ICON_SPACING = 10
@@ -811,73 +723,108 @@ def is_icon_clicked(pos, icon_x, icon_y):
     dist = ((px - center_x) ** 2 + (py - center_y) ** 2) ** 0.5
     return dist <= ICON_SIZE // 2
 
-# Create board
-board = Board()
-board.init()
-
-# Main game loop
-running = True
-
-while running:
-    mouse_pos = pygame.mouse.get_pos()
-    
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
-            running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN:
-            if event.button == pygame.BUTTON_LEFT:
-                # Check if any power-up icon was clicked
-                if is_icon_clicked(event.pos, COLOR_BOMB_X, ICONS_Y):
-                    board.toggle_color_bomb()
-                elif is_icon_clicked(event.pos, ROW_BOMB_X, ICONS_Y):
-                    board.toggle_row_bomb()
-                elif is_icon_clicked(event.pos, COL_BOMB_X, ICONS_Y):
-                    board.toggle_col_bomb()
-                else:
-                    board.on_click(event.pos)
-            elif event.button == pygame.BUTTON_RIGHT:
-                board.on_right_click()
-        elif event.type == pygame.KEYDOWN:
-            if event.key == pygame.K_r:
-                # Reset game
-                board.init()
-    
-    clock.tick(fps)
-    
-    # Update
-    board.update(mouse_pos)
-    
-    # Draw
-    screen.fill(BACKGROUND)
-    board.draw(screen)
-    
-    # Draw score
-    score_y = GRID_HEIGHT * (BLOCK_SIZE + BLOCK_SPACE) + BLOCK_SPACE + 20
-    score_text = score_font.render(f"Score: {board.score}", True, (50, 50, 100))
-    screen.blit(score_text, (20, score_y))
-    
-    # Draw combo indicator
-    if board.combo > 1:
-        combo_text = combo_font.render(f"Combo x{board.combo}!", True, (200, 50, 50))
-        screen.blit(combo_text, (20, score_y + 40))
-    
-    # Draw power-up icons
-    draw_row_bomb_icon(screen, ROW_BOMB_X, ICONS_Y, board.row_bomb_active)
-    draw_col_bomb_icon(screen, COL_BOMB_X, ICONS_Y, board.col_bomb_active)
-    draw_color_bomb_icon(screen, COLOR_BOMB_X, ICONS_Y, board.color_bomb_active)
-    
-    # Draw active power-up indicator
-    if board.color_bomb_active:
-        hint_text = combo_font.render("Click a color!", True, (255, 200, 100))
-        screen.blit(hint_text, (ROW_BOMB_X, ICONS_Y + ICON_SIZE + 5))
-    elif board.row_bomb_active:
-        hint_text = combo_font.render("Click a row!", True, (100, 200, 255))
-        screen.blit(hint_text, (ROW_BOMB_X, ICONS_Y + ICON_SIZE + 5))
-    elif board.col_bomb_active:
-        hint_text = combo_font.render("Click a column!", True, (200, 100, 255))
-        screen.blit(hint_text, (ROW_BOMB_X, ICONS_Y + ICON_SIZE + 5))
-    
-    pygame.display.flip()
-
-pygame.quit()
-sys.exit()
+
+def save_replay(board):
+    """Append the current game to the replay file if any move was made"""
+    if board.engine.moves:
+        record = swap_replay(board.engine)
+        if board.state != Board.IDLE:
+            # The engine is partway through the last move's cascade
+            record['unfinished'] = True
+        append_replay(record)
+
+
+def main():
+    pygame.init()
+    
+    # Setup the display
+    screen = pygame.display.set_mode(
+        (SCREEN_WIDTH, SCREEN_HEIGHT),
+        pygame.HWSURFACE | pygame.DOUBLEBUF
+    )
+    pygame.display.set_caption("Swap")
+    clock = pygame.time.Clock()
+    fps = 60
+    
+    # Fonts
+    score_font = pygame.font.Font(None, 48)
+    combo_font = pygame.font.Font(None, 36)
+    
+    # Create board
+    board = Board()
+    board.init()
+
+    # Main game loop
+    running = True
+
+    while running:
+        mouse_pos = pygame.mouse.get_pos()
+        
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                if event.button == pygame.BUTTON_LEFT:
+                    # Check if any power-up icon was clicked
+                    if is_icon_clicked(event.pos, COLOR_BOMB_X, ICONS_Y):
+                        board.toggle_color_bomb()
+                    elif is_icon_clicked(event.pos, ROW_BOMB_X, ICONS_Y):
+                        board.toggle_row_bomb()
+                    elif is_icon_clicked(event.pos, COL_BOMB_X, ICONS_Y):
+                        board.toggle_col_bomb()
+                    else:
+                        board.on_click(event.pos)
+                elif event.button == pygame.BUTTON_RIGHT:
+                    board.on_right_click()
+            elif event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_r:
+                    # Reset game
+                    save_replay(board)
+                    board.init()
+                elif event.key == pygame.K_h:
+                    board.show_hint()
+        
+        clock.tick(fps)
+        
+        # Update
+        board.update(mouse_pos)
+        
+        # Draw
+        screen.fill(BACKGROUND)
+        board.draw(screen)
+        
+        # Draw score
+        score_y = GRID_HEIGHT * (BLOCK_SIZE + BLOCK_SPACE) + BLOCK_SPACE + 20
+        score_text = score_font.render(f"Score: {board.score}", True, (50, 50, 100))
+        screen.blit(score_text, (20, score_y))
+        
+        # Draw combo indicator
+        if board.combo > 1:
+            combo_text = combo_font.render(f"Combo x{board.combo}!", True, (200, 50, 50))
+            screen.blit(combo_text, (20, score_y + 40))
+        
+        # Draw power-up icons
+        draw_row_bomb_icon(screen, ROW_BOMB_X, ICONS_Y, board.row_bomb_active)
+        draw_col_bomb_icon(screen, COL_BOMB_X, ICONS_Y, board.col_bomb_active)
+        draw_color_bomb_icon(screen, COLOR_BOMB_X, ICONS_Y, board.color_bomb_active)
+        
+        # Draw active power-up indicator
+        if board.color_bomb_active:
+            hint_text = combo_font.render("Click a color!", True, (255, 200, 100))
+            screen.blit(hint_text, (ROW_BOMB_X, ICONS_Y + ICON_SIZE + 5))
+        elif board.row_bomb_active:
+            hint_text = combo_font.render("Click a row!", True, (100, 200, 255))
+            screen.blit(hint_text, (ROW_BOMB_X, ICONS_Y + ICON_SIZE + 5))
+        elif board.col_bomb_active:
+            hint_text = combo_font.render("Click a column!", True, (200, 100, 255))
+            screen.blit(hint_text, (ROW_BOMB_X, ICONS_Y + ICON_SIZE + 5))
+        
+        pygame.display.flip()
+    
+    save_replay(board)
+    pygame.quit()
+    sys.exit()
+
+
+if __name__ == '__main__':
+    main()
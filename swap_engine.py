@@ -0,0 +1,349 @@
+import random
+
+import numpy as np
+
+GRID_WIDTH = 17
+GRID_HEIGHT = 17
+COLOR_COUNT = 6
+
+# Marks a cell without a block in SwapEngine.color_grid
+EMPTY = -1
+
+
+def run_mask(lines):
+    """Boolean mask of the cells in 3+ runs of one color along each row of lines"""
+    # Each cell equal to the one before it
+    same = (lines[:, 1:] == lines[:, :-1]) & (lines[:, 1:] != EMPTY)
+    # Three in a row starting at each cell
+    three = same[:, :-1] & same[:, 1:]
+    matched = np.zeros(lines.shape, dtype=bool)
+    matched[:, :-2] |= three
+    matched[:, 1:-1] |= three
+    matched[:, 2:] |= three
+    return matched
+
+
+def match_mask(color_grid):
+    """Boolean mask of the cells in 3+ runs of one color, horizontal or vertical"""
+    # Rows of color_grid are cy, so the transpose holds the columns
+    return run_mask(color_grid) | run_mask(color_grid.T).T
+
+
+def swap_mask(color_grid):
+    """Boolean mask of the cells whose swap with the right neighbour makes a match
+
+    A block moved right can only line up with the column it lands in or the
+    two cells past it, and likewise for the block moved left, so each swap
+    is checked against those fixed patterns.
+    """
+    height, width = color_grid.shape
+    padded = np.full((height + 6, width + 6), EMPTY, dtype=color_grid.dtype)
+    padded[3:-3, 3:-3] = color_grid
+
+    def at(dy, dx):
+        # Color of cell (cx + dx, cy + dy) for every cell
+        return padded[3 + dy:3 + dy + height, 3 + dx:3 + dx + width]
+
+    def lines_up(color, dx, away):
+        # color placed at column offset dx makes a vertical run there, or a
+        # horizontal run with the two cells beyond it in direction away
+        up2, up1, down1, down2 = (at(dy, dx) == color for dy in (-2, -1, 1, 2))
+        return ((up2 & up1) | (up1 & down1) | (down1 & down2)
+                | ((at(0, dx + away) == color) & (at(0, dx + 2 * away) == color)))
+
+    left, right = at(0, 0), at(0, 1)
+    return ((left != right) & (left != EMPTY) & (right != EMPTY)
+            & (lines_up(left, 1, 1) | lines_up(right, 0, -1)))
+
+
+def is_adjacent(cell1, cell2):
+    """Check if two cells are exactly one step apart horizontally or vertically"""
+    return abs(cell1[0] - cell2[0]) + abs(cell1[1] - cell2[1]) == 1
+
+
+class SwapEngine:
+    """Match-3 rules without pygame.
+
+    The grid is a NumPy matrix of color indices indexed ``[cy, cx]``, with
+    ``EMPTY`` for cells whose block was removed. ``swap.Board`` drives the
+    engine one step at a time while it animates blocks; ``swap()`` and
+    ``bomb()`` resolve a whole cascade synchronously for headless play.
+
+    All randomness comes from ``self.random``, seeded by ``reset()``, and
+    ``moves`` logs every player swap and bomb, so a game's seed and moves
+    replay it exactly.
+    """
+
+    def __init__(self, color_count=COLOR_COUNT):
+        self.color_count = color_count
+        self.color_grid = np.full((GRID_HEIGHT, GRID_WIDTH), EMPTY, dtype=np.int8)
+        # Number of cells without a block in each column
+        self.empty_counts = [GRID_HEIGHT] * GRID_WIDTH
+        # The cells of a player swap not yet checked, or None to check the
+        # whole grid
+        self.swapped = None
+        # Swaps that make a match, refreshed whenever the board settles
+        self.valid_moves = []
+        self.score = 0
+        self.combo = 0  # Chain combo multiplier
+        self.seed = None
+        self.random = random.Random()
+        # Player inputs since reset(): [cx1, cy1, cx2, cy2] for a swap,
+        # [kind, target] for a bomb
+        self.moves = []
+
+    def reset(self, seed=None):
+        """Fill the grid with random colors, avoiding initial matches
+
+        The game is seeded with seed, or with a fresh random seed.
+        """
+        if seed is None:
+            seed = random.randrange(2 ** 32)
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.moves = []
+        self.color_grid.fill(EMPTY)
+        self.empty_counts = [GRID_HEIGHT] * GRID_WIDTH
+        self.swapped = None
+        self.score = 0
+        self.combo = 0
+        for cy in range(GRID_HEIGHT):
+            for cx in range(GRID_WIDTH):
+                self.set_color(cx, cy, self.safe_color(cx, cy))
+        self.settle()
+
+    def color_at(self, cx, cy):
+        """Color index at (cx, cy), or None for an empty cell"""
+        color = int(self.color_grid[cy, cx])
+        return None if color == EMPTY else color
+
+    def set_color(self, cx, cy, color):
+        """Set the color index (or EMPTY) at (cx, cy)"""
+        if self.color_grid[cy, cx] == EMPTY:
+            self.empty_counts[cx] -= 1
+        if color == EMPTY:
+            self.empty_counts[cx] += 1
+        self.color_grid[cy, cx] = color
+
+    def safe_color(self, cx, cy):
+        """Get a color that won't create a match with the cells left of and above (cx, cy)"""
+        forbidden = set()
+
+        # Check horizontal - if two cells to the left have same color, forbid it
+        if cx >= 2:
+            left1 = self.color_grid[cy, cx - 1]
+            if left1 != EMPTY and left1 == self.color_grid[cy, cx - 2]:
+                forbidden.add(int(left1))
+
+        # Check vertical - if two cells above have same color, forbid it
+        if cy >= 2:
+            up1 = self.color_grid[cy - 1, cx]
+            if up1 != EMPTY and up1 == self.color_grid[cy - 2, cx]:
+                forbidden.add(int(up1))
+
+        # Choose from allowed colors
+        allowed = [c for c in range(self.color_count) if c not in forbidden]
+        if not allowed:
+            allowed = list(range(self.color_count))  # Fallback if all forbidden (shouldn't happen)
+        return self.random.choice(allowed)
+
+    def swap_cells(self, cell1, cell2):
+        """Exchange the colors of two cells"""
+        (cx1, cy1), (cx2, cy2) = cell1, cell2
+        color1, color2 = int(self.color_grid[cy1, cx1]), int(self.color_grid[cy2, cx2])
+        self.set_color(cx1, cy1, color2)
+        self.set_color(cx2, cy2, color1)
+
+    def player_swap(self, cell1, cell2):
+        """Swap two cells for a player move and log it"""
+        self.moves.append([*cell1, *cell2])
+        self.swap_cells(cell1, cell2)
+        # The next check only needs the lines through these two
+        self.swapped = (cell1, cell2)
+
+    def swap_back(self, cell1, cell2):
+        """Undo a checked swap that made no match"""
+        self.swap_cells(cell1, cell2)
+        # The grid is back to its checked state
+        self.swapped = None
+
+    def find_matches(self, cells=None):
+        """Find all matching cells (3+ in a row horizontally or vertically)
+
+        With cells, only the runs through them are followed. That finds
+        every match as long as the grid had none before those cells changed.
+        Without, the whole grid is scanned.
+        """
+        if cells is None:
+            cys, cxs = np.nonzero(match_mask(self.color_grid))
+            return set(zip(cxs.tolist(), cys.tolist()))
+
+        grid = self.color_grid
+        matches = set()
+        for cx, cy in cells:
+            color = grid[cy, cx]
+            if color == EMPTY:
+                continue
+            for dx, dy in ((1, 0), (0, 1)):
+                run = [(cx, cy)]
+                for step in (1, -1):
+                    x, y = cx + dx * step, cy + dy * step
+                    while 0 <= x < GRID_WIDTH and 0 <= y < GRID_HEIGHT and grid[y, x] == color:
+                        run.append((x, y))
+                        x, y = x + dx * step, y + dy * step
+                if len(run) >= 3:
+                    matches.update(run)
+        return matches
+
+    def check(self):
+        """Find the matches made since the last check
+
+        After a player swap only the runs through the two swapped cells are
+        followed; after gravity, which moves whole columns, the grid is
+        scanned.
+        """
+        matches = self.find_matches(self.swapped)
+        self.swapped = None
+        return matches
+
+    def find_valid_moves(self):
+        """Find all swaps that make a match, as ((cx, cy), (cx, cy)) pairs"""
+        moves = []
+        cys, cxs = np.nonzero(swap_mask(self.color_grid))
+        for cx, cy in zip(cxs.tolist(), cys.tolist()):
+            moves.append(((cx, cy), (cx + 1, cy)))
+        # Vertical swaps are horizontal ones on the transposed grid
+        cxs, cys = np.nonzero(swap_mask(self.color_grid.T))
+        for cx, cy in zip(cxs.tolist(), cys.tolist()):
+            moves.append(((cx, cy), (cx, cy + 1)))
+        return moves
+
+    def settle(self):
+        """Refresh valid_moves once cascades end, reshuffling on deadlock"""
+        self.valid_moves = self.find_valid_moves()
+        while not self.valid_moves:
+            self.reshuffle()
+            self.valid_moves = self.find_valid_moves()
+
+    def reshuffle(self):
+        """Give every cell a new color, avoiding matches like reset()"""
+        for cy in range(GRID_HEIGHT):
+            for cx in range(GRID_WIDTH):
+                self.set_color(cx, cy, self.safe_color(cx, cy))
+
+    def end_cascade(self):
+        """Reset the combo when a chain ends and refresh valid_moves"""
+        self.combo = 0
+        self.settle()
+
+    def remove(self, cells):
+        """Empty the cells and score them with the combo multiplier"""
+        for cx, cy in cells:
+            self.set_color(cx, cy, EMPTY)
+        # Gravity will move whole columns
+        self.swapped = None
+        self.combo += 1
+        points = len(cells) * 10 * self.combo
+        self.score += points
+        return points
+
+    def bomb_cells(self, kind, target):
+        """Cells cleared by a player's bomb, logging its use
+
+        kind is 'color', 'row' or 'col', and target the color index, row or
+        column it was aimed at.
+        """
+        self.moves.append([kind, target])
+        if kind == 'color':
+            return self.color_bomb_cells(target)
+        if kind == 'row':
+            return self.row_bomb_cells(target)
+        if kind == 'col':
+            return self.col_bomb_cells(target)
+        raise ValueError('Unknown bomb %r' % kind)
+
+    def color_bomb_cells(self, color):
+        """Cells holding color"""
+        cys, cxs = np.nonzero(self.color_grid == color)
+        return set(zip(cxs.tolist(), cys.tolist()))
+
+    def row_bomb_cells(self, cy):
+        """Cells with a block in row cy"""
+        return {(cx, cy) for cx in range(GRID_WIDTH) if self.color_grid[cy, cx] != EMPTY}
+
+    def col_bomb_cells(self, cx):
+        """Cells with a block in column cx"""
+        return {(cx, cy) for cy in range(GRID_HEIGHT) if self.color_grid[cy, cx] != EMPTY}
+
+    def has_empty_cells(self):
+        """Check if there are any empty cells in the grid"""
+        return any(self.empty_counts)
+
+    def gravity(self):
+        """Compact every column with empty cells and refill it from the top.
+
+        Returns (cx, old_cy, cy) for each block that moved, bottom up within
+        each column. Refills start above the grid, at negative old_cy.
+        """
+        moves = []
+        for cx in range(GRID_WIDTH):
+            empty_count = self.empty_counts[cx]
+            if not empty_count:
+                continue
+
+            # Blocks in the column from the bottom up, then the refills
+            column = [
+                (cy, int(self.color_grid[cy, cx]))
+                for cy in range(GRID_HEIGHT - 1, -1, -1)
+                if self.color_grid[cy, cx] != EMPTY
+            ]
+            for i in range(empty_count):
+                column.append((-1 - i, self.random.randrange(self.color_count)))
+
+            for i, (old_cy, color) in enumerate(column):
+                cy = GRID_HEIGHT - 1 - i
+                if old_cy == cy:
+                    continue
+                self.set_color(cx, cy, color)
+                moves.append((cx, old_cy, cy))
+        return moves
+
+    def cascade(self, cells):
+        """Remove cells, then let blocks fall and clear the matches they make.
+
+        Returns the points scored and the number of removal rounds.
+        """
+        points = 0
+        rounds = 0
+        matches = cells
+        while matches:
+            points += self.remove(matches)
+            rounds += 1
+            self.gravity()
+            matches = self.check()
+        self.end_cascade()
+        return points, rounds
+
+    def swap(self, cell1, cell2):
+        """Swap two adjacent cells and resolve the whole cascade.
+
+        A swap that makes no match is undone. Returns a dict describing what
+        happened.
+        """
+        if not is_adjacent(cell1, cell2):
+            raise ValueError('Cells %s and %s are not adjacent' % (cell1, cell2))
+        self.player_swap(cell1, cell2)
+        matches = self.check()
+        if not matches:
+            self.swap_back(cell1, cell2)
+            return {'valid': False, 'points': 0, 'rounds': 0}
+        points, rounds = self.cascade(matches)
+        return {'valid': True, 'points': points, 'rounds': rounds}
+
+    def bomb(self, kind, target):
+        """Use a bomb as bomb_cells() describes and resolve the cascade"""
+        cells = self.bomb_cells(kind, target)
+        if not cells:
+            return {'points': 0, 'rounds': 0}
+        points, rounds = self.cascade(cells)
+        return {'points': points, 'rounds': rounds}
@@ -0,0 +1,129 @@
+"""Play swap games headless and report score and combo distributions.
+
+Usage: python swap_simulate.py --games 100000 --workers 8 --moves 50
+
+Game i is seeded with --seed + i and plays --moves swaps picked by
+--policy. Line i of --output holds its record: the final score and, for
+each combo length, how many moves cascaded that far.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import functools
+from concurrent.futures import ProcessPoolExecutor
+
+from swap_engine import SwapEngine
+
+
+def random_policy(engine):
+    return random.choice(engine.valid_moves)
+
+
+def greedy_policy(engine):
+    """Pick the swap that matches the most cells straight away."""
+    best_moves = []
+    best_size = 0
+    for cell1, cell2 in engine.valid_moves:
+        engine.swap_cells(cell1, cell2)
+        size = len(engine.find_matches([cell1, cell2]))
+        engine.swap_back(cell1, cell2)
+        if size > best_size:
+            best_moves = [(cell1, cell2)]
+            best_size = size
+        elif size == best_size:
+            best_moves.append((cell1, cell2))
+    return random.choice(best_moves)
+
+
+POLICIES = {
+    'random': random_policy,
+    'greedy': greedy_policy,
+}
+
+
+def play_game(seed, policy='random', moves=50):
+    """Play one seeded game of ``moves`` swaps and return its record."""
+    random.seed(seed)
+    pick = POLICIES[policy]
+    engine = SwapEngine()
+    engine.reset(seed)
+    # combo_counts[i] moves cascaded to combo i + 1
+    combo_counts = []
+    for _ in range(moves):
+        result = engine.swap(*pick(engine))
+        rounds = result['rounds']
+        while len(combo_counts) < rounds:
+            combo_counts.append(0)
+        combo_counts[rounds - 1] += 1
+    return {
+        'seed': seed,
+        'policy': policy,
+        'moves': moves,
+        'score': engine.score,
+        'max_combo': len(combo_counts),
+        'combo_counts': combo_counts,
+    }
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(int(fraction * len(sorted_values)), len(sorted_values) - 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='random')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first game')
+    parser.add_argument('--moves', type=int, default=50, help='swaps per game')
+    parser.add_argument('--output', default='swap_sim.jsonl')
+    args = parser.parse_args()
+    if args.games < 1:
+        parser.error('--games must be at least 1')
+
+    play = functools.partial(play_game, policy=args.policy, moves=args.moves)
+    seeds = range(args.seed, args.seed + args.games)
+
+    start = time.perf_counter()
+    scores = []
+    combo_totals = []
+    executor = None
+    if args.workers > 1:
+        executor = ProcessPoolExecutor(max_workers=args.workers)
+        chunksize = max(1, args.games // (args.workers * 16))
+        records = executor.map(play, seeds, chunksize=chunksize)
+    else:
+        records = map(play, seeds)
+    try:
+        with open(args.output, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+                scores.append(record['score'])
+                for i, count in enumerate(record['combo_counts']):
+                    if i == len(combo_totals):
+                        combo_totals.append(0)
+                    combo_totals[i] += count
+    finally:
+        if executor:
+            executor.shutdown()
+    elapsed = time.perf_counter() - start
+
+    scores.sort()
+    print('%d games of %d moves in %.1fs (%.0f games/s, %d workers)' % (
+        args.games, args.moves, elapsed, args.games / elapsed, args.workers))
+    print('score: mean %.0f, p10 %d, median %d, p90 %d, max %d' % (
+        sum(scores) / len(scores), percentile(scores, 0.1), percentile(scores, 0.5),
+        percentile(scores, 0.9), scores[-1]))
+    total_moves = sum(combo_totals)
+    print('moves by combo reached:')
+    for i, count in enumerate(combo_totals):
+        print('  x%-3d %6.2f%%' % (i + 1, 100.0 * count / total_moves))
+    print('records written to %s' % args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,85 @@
+import math
+import random
+
+import pytest
+
+from constants import GRID_WIDTH, GRID_HEIGHT, SCREEN_WIDTH, SCREEN_HEIGHT
+from engine import Engine, EMPTY, GRID_SIZE
+from utils import NEIGHBOURS, get_cell, get_center, get_distance, index_cell
+from stats import GameStats
+
+
+def test_rejected_shot_changes_nothing():
+    stats = GameStats()
+    engine = Engine(stats=stats)
+    engine.new_game(1)
+    color = engine.preview_color
+    for angle in (0.5, 0.0, 2.0):
+        with pytest.raises(ValueError):
+            engine.fire(angle)
+        with pytest.raises(ValueError):
+            engine.shoot(angle)
+    assert engine.shots == []
+    assert engine.preview_color == color
+    assert stats.shots_fired == 0
+
+    engine.shoot(-1.0)
+    assert engine.shots == [-1.0]
+    assert stats.shots_fired == 1
+
+
+def floating_cells(cells):
+    """Bubbles not connected to the top row, by a flood fill of the whole grid"""
+    hanging = [i for i in range(GRID_WIDTH) if cells[i] != EMPTY]
+    seen = set(hanging)
+    for i in hanging:
+        for n in NEIGHBOURS[i]:
+            if n not in seen and cells[n] != EMPTY:
+                seen.add(n)
+                hanging.append(n)
+    return [index_cell(i) for i, color in enumerate(cells) if color != EMPTY and i not in seen]
+
+
+def test_remove_disjoint_matches_full_flood_fill(monkeypatch):
+    remove_disjoint = Engine.remove_disjoint
+    calls = []
+
+    def checked(engine):
+        expected = floating_cells(engine.cells)
+        removed = remove_disjoint(engine)
+        assert removed == expected
+        assert floating_cells(engine.cells) == []
+        calls.append(bool(removed))
+        return removed
+
+    monkeypatch.setattr(Engine, 'remove_disjoint', checked)
+    rng = random.Random(0)
+    for seed in range(20):
+        engine = Engine()
+        engine.new_game(seed)
+        while not engine.over:
+            engine.shoot(rng.uniform(-math.pi + 0.1, -0.1))
+    # Some shots must actually have dropped bubbles
+    assert any(calls)
+
+
+def test_snap_finds_closest_free_cell():
+    rng = random.Random(5)
+    engine = Engine()
+    for cy in range(GRID_HEIGHT):
+        for cx in range(GRID_WIDTH):
+            assert get_cell(*get_center(cx, cy)) == (cx, cy)
+    for _ in range(500):
+        fill = rng.random()
+        for i in range(GRID_SIZE):
+            engine.cells[i] = rng.randrange(6) if rng.random() < fill else EMPTY
+        if EMPTY not in engine.cells:
+            continue
+        x = rng.uniform(-200, SCREEN_WIDTH + 200)
+        y = rng.uniform(-200, SCREEN_HEIGHT + 200)
+        distance = get_distance((x, y), get_center(*engine.snap(x, y)))
+        closest = min(
+            get_distance((x, y), get_center(*index_cell(i)))
+            for i in range(GRID_SIZE) if engine.cells[i] == EMPTY
+        )
+        assert distance == pytest.approx(closest)
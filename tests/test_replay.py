@@ -0,0 +1,82 @@
+import json
+import math
+import random
+
+from engine import Engine
+from swap_engine import SwapEngine, GRID_WIDTH, GRID_HEIGHT
+from replay import bubbles_replay, swap_replay, replay, replay_matches, append_replay, load_replays
+
+
+def play_bubbles(seed):
+    rng = random.Random(seed)
+    engine = Engine()
+    engine.new_game(seed)
+    while not engine.over:
+        engine.shoot(rng.uniform(-math.pi + 0.1, -0.1))
+    return bubbles_replay(engine)
+
+
+def play_swap(seed, moves=40):
+    rng = random.Random(seed)
+    engine = SwapEngine()
+    engine.reset(seed)
+    for _ in range(moves):
+        if rng.random() < 0.15:
+            kind = rng.choice(['color', 'row', 'col'])
+            limit = engine.color_count if kind == 'color' else GRID_WIDTH
+            engine.bomb(kind, rng.randrange(limit))
+        else:
+            engine.swap(*rng.choice(engine.valid_moves))
+            # Swaps that make no match are logged and replayed too
+            cx, cy = rng.randrange(GRID_WIDTH), rng.randrange(GRID_HEIGHT - 1)
+            engine.swap((cx, cy), (cx, cy + 1))
+    return swap_replay(engine)
+
+
+def test_bubbles_replays_reproduce_games():
+    for seed in range(10):
+        record = json.loads(json.dumps(play_bubbles(seed)))
+        assert replay(record) == record
+
+
+def test_bubbles_replay_detects_other_inputs():
+    record = play_bubbles(1)
+    record['shots'][0] += 0.3
+    assert replay(record) != record
+
+
+def test_swap_replays_reproduce_games():
+    for seed in range(10):
+        record = json.loads(json.dumps(play_swap(seed)))
+        assert replay(record) == record
+
+
+def test_unfinished_games_are_not_compared():
+    # As the GUI leaves them while animating: the input logged, not resolved
+    engine = Engine()
+    engine.new_game(4)
+    engine.shoot(-1.0)
+    engine.fire(-2.0)
+    record = bubbles_replay(engine)
+    assert replay(record) != record
+    record['unfinished'] = True
+    assert replay_matches(record) is None
+
+    engine = SwapEngine()
+    engine.reset(4)
+    engine.player_swap(*engine.valid_moves[0])
+    record = swap_replay(engine)
+    assert replay(record) != record
+    record['unfinished'] = True
+    assert replay_matches(record) is None
+    assert replay_matches(play_swap(4)) is True
+
+
+def test_replay_file_round_trip(tmp_path):
+    path = tmp_path / 'replays.jsonl'
+    records = [play_bubbles(2), play_swap(3)]
+    for record in records:
+        append_replay(record, path)
+    loaded = load_replays(path)
+    assert loaded == json.loads(json.dumps(records))
+    assert [replay(record) for record in loaded] == loaded
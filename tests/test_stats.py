@@ -0,0 +1,230 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+import stats
+import stats_columns
+from stats import (
+    GameStats, iter_records, filter_records, aggregate_records, load_aggregate_stats,
+    started_between, result_is, colors_in_play,
+)
+
+START = datetime(2026, 1, 1)
+
+
+def make_record(i):
+    """A game record whose values vary with i"""
+    game_stats = GameStats()
+    game_stats.start_time = START + timedelta(hours=i)
+    game_stats.colors_in_play = 3 + i % 4
+    for _ in range(10 + i % 7):
+        game_stats.record_shot()
+    game_stats.record_match(3 + i % 5)
+    record = game_stats.build_record(win=i % 3 != 0, bubbles_remaining=i % 11, rows_advanced=i % 9)
+    record["duration_sec"] = 60.0 + i
+    return record
+
+
+def write_lines(path, lines, mode="w"):
+    with open(path, mode + "b") as f:
+        for line in lines:
+            f.write(line if isinstance(line, bytes) else line.encode())
+
+
+def record_lines(records):
+    return [json.dumps(record) + "\n" for record in records]
+
+
+def brute_aggregates(records):
+    """Aggregates the way the loader used to compute them, from a list"""
+    if not records:
+        return None
+    wins = [r for r in records if r["result"] == "win"]
+    agg = {
+        "games_played": len(records),
+        "wins": len(wins),
+        "losses": len(records) - len(wins),
+        "win_rate": len(wins) / len(records),
+    }
+    for key, field in stats.MAX_FIELDS.items():
+        agg[key] = max(r[field] for r in records)
+    for key, field in stats.MIN_WIN_FIELDS.items():
+        agg[key] = min((r[field] for r in wins), default=None)
+    return agg
+
+
+def test_streaming_aggregates_match_list_aggregates(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(50)]
+    write_lines(path, record_lines(records))
+    assert list(iter_records(path)) == records
+    assert aggregate_records(iter_records(path)) == brute_aggregates(records)
+    assert load_aggregate_stats(path) == brute_aggregates(records)
+
+
+def test_filters_compose(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(50)]
+    write_lines(path, record_lines(records))
+
+    def query(*filters):
+        return list(filter_records(iter_records(path), *filters))
+
+    assert query(result_is("win")) == [r for r in records if r["result"] == "win"]
+    assert query(colors_in_play(3, 5)) == [r for r in records if r["colors_in_play"] in (3, 5)]
+    since, until = START + timedelta(hours=10), "2026-01-01T20:00:00"
+    assert query(started_between(since, until)) == records[10:20]
+    assert query(started_between(end="2026-01-02")) == records[:24]
+    assert query(started_between("2026-01-01T20"), result_is("loss"), colors_in_play(3, 4, 5, 6)) == [
+        r for r in records[20:] if r["result"] == "loss"]
+    assert aggregate_records(filter_records(iter_records(path), started_between(end="2000-01-01"))) is None
+
+
+def test_bad_lines_are_skipped(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(6)]
+    lines = record_lines(records)
+    null_accuracy = dict(records[0], accuracy=None)
+    string_shots = dict(records[0], shots_fired="10")
+    missing_result = {k: v for k, v in records[0].items() if k != "result"}
+    write_lines(path, [
+        lines[0], "\n", "{not json\n", "[]\n", "1\n", '"x"\n',
+        lines[1], json.dumps(null_accuracy) + "\n", json.dumps(string_shots) + "\n",
+        json.dumps(missing_result) + "\n", lines[2],
+        # A record with a byte that isn't UTF-8
+        lines[3].encode().replace(b'"loss"', b'"lo\xffs"'),
+        lines[4], lines[5],
+    ])
+    kept = records[:3] + records[4:]
+    assert list(iter_records(path)) == kept
+    assert load_aggregate_stats(path) == brute_aggregates(kept)
+    # The index still matches the file on the next load
+    assert stats.index_matches(path, stats.load_summary(path))
+    write_lines(path, record_lines([records[3]]), mode="a")
+    assert load_aggregate_stats(path) == brute_aggregates(records)
+
+
+def test_index_catches_up_with_appended_lines(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(20)]
+    for record in records[:5]:
+        stats.append_stats(record, path)
+    summary = stats.load_summary(path)
+    assert summary["games_played"] == 5
+    # Appended by another writer, so the index is behind
+    write_lines(path, record_lines(records[5:]), mode="a")
+    assert load_aggregate_stats(path) == brute_aggregates(records)
+    assert stats.load_summary(path)["size"] == path.stat().st_size
+
+
+def test_index_rebuilt_when_file_is_rewritten(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(20)]
+    write_lines(path, record_lines(records))
+    assert load_aggregate_stats(path) == brute_aggregates(records)
+    # Truncated, then rewritten with other games of the same total length
+    write_lines(path, record_lines(records[:8]))
+    assert load_aggregate_stats(path) == brute_aggregates(records[:8])
+    write_lines(path, record_lines(records[:7] + records[12:13]))
+    assert load_aggregate_stats(path) == brute_aggregates(records[:7] + records[12:13])
+    # An unreadable index is rebuilt too
+    stats.index_path(path).write_text("{")
+    assert load_aggregate_stats(path) == brute_aggregates(records[:7] + records[12:13])
+
+
+def test_unterminated_last_line_is_counted(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(4)]
+    lines = record_lines(records)
+    write_lines(path, lines[:3] + [lines[3].rstrip("\n")])
+    assert list(iter_records(path)) == records
+    assert load_aggregate_stats(path) == brute_aggregates(records)
+    # Appending starts a new line rather than running on from it
+    record = make_record(4)
+    stats.append_stats(record, path)
+    assert list(iter_records(path)) == records + [record]
+    assert load_aggregate_stats(path) == brute_aggregates(records + [record])
+
+
+def test_record_being_written_is_not_lost(tmp_path):
+    path = tmp_path / "stats.jsonl"
+    records = [make_record(i) for i in range(4)]
+    lines = record_lines(records)
+    # Read, or the index rebuilt, while the last record is half written
+    write_lines(path, lines[:3] + [lines[3][:40]])
+    assert stats.rebuild_stats_index(path)["games_played"] == 3
+    assert load_aggregate_stats(path) == brute_aggregates(records[:3])
+    write_lines(path, [lines[3][40:]], mode="a")
+    assert load_aggregate_stats(path) == brute_aggregates(records)
+    assert len(list(iter_records(path))) == 4
+
+
+def test_main_reports_stale_index_only(tmp_path, monkeypatch, capsys):
+    path = tmp_path / "stats.jsonl"
+    write_lines(path, record_lines([make_record(i) for i in range(3)]))
+
+    def run():
+        monkeypatch.setattr("sys.argv", ["stats.py", str(path)])
+        assert stats.main() == 0
+        return capsys.readouterr().out
+
+    assert run() == "%s: 3 games indexed\n" % path
+    assert run() == "%s: 3 games indexed\n" % path
+    write_lines(path, record_lines([make_record(3)]), mode="a")
+    assert run() == "%s: 4 games indexed, index was stale\n" % path
+
+
+def test_columns_round_trip(tmp_path):
+    path = tmp_path / "stats.cols"
+    records = [make_record(i) for i in range(30)]
+    stats_columns.append_columns(records[:10], path)
+    stats_columns.append_columns(records[10:], path)
+    data = stats_columns.load_columns(path)
+    assert [stats_columns.decode_row(row) for row in data] == records
+    assert stats_columns.aggregate_columns(data) == brute_aggregates(records)
+    counts, edges = stats_columns.histogram(data, "shots_fired")
+    assert counts.sum() == len(records)
+    assert counts[10] == sum(r["shots_fired"] == 10 for r in records)
+
+
+def test_columns_drop_half_written_row(tmp_path):
+    path = tmp_path / "stats.cols"
+    records = [make_record(i) for i in range(5)]
+    stats_columns.append_columns(records[:3], path)
+    with open(path, "ab") as f:
+        f.write(b"\0" * (stats_columns.RECORD_DTYPE.itemsize // 2))
+    # A partial row is not loaded, and is overwritten by the next append
+    assert len(stats_columns.load_columns(path)) == 3
+    stats_columns.append_columns(records[3:], path)
+    assert [stats_columns.decode_row(row) for row in stats_columns.load_columns(path)] == records
+
+
+def test_columns_without_header(tmp_path):
+    path = tmp_path / "stats.cols"
+    records = [make_record(i) for i in range(3)]
+    for content in (b"", stats_columns.MAGIC[:4]):
+        path.write_bytes(content)
+        assert len(stats_columns.load_columns(path)) == 0
+        assert stats_columns.aggregate_columns(stats_columns.load_columns(path)) is None
+        stats_columns.append_columns(records, path)
+        assert [stats_columns.decode_row(row) for row in stats_columns.load_columns(path)] == records
+
+    path.write_bytes(b"x" * 100)
+    with pytest.raises(ValueError, match="not a stats column file"):
+        stats_columns.load_columns(path)
+    path.write_bytes(stats_columns.HEADER.pack(stats_columns.MAGIC, stats_columns.VERSION + 1, 8))
+    with pytest.raises(ValueError, match="version"):
+        stats_columns.load_columns(path)
+
+
+def test_convert_skips_the_same_lines(tmp_path):
+    jsonl_path = tmp_path / "stats.jsonl"
+    path = tmp_path / "stats.cols"
+    records = [make_record(i) for i in range(25)]
+    lines = record_lines(records)
+    write_lines(jsonl_path, lines[:10] + ["{bad\n", "[]\n", b"\xff\n"] + lines[10:-1] + [lines[-1].rstrip("\n")])
+    assert stats_columns.convert(jsonl_path, path, chunk_size=4) == len(records)
+    data = stats_columns.load_columns(path)
+    assert [stats_columns.decode_row(row) for row in data] == list(iter_records(jsonl_path)) == records
+    assert stats_columns.aggregate_columns(data) == load_aggregate_stats(jsonl_path)
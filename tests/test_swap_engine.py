@@ -0,0 +1,81 @@
+import random
+
+import numpy as np
+
+from swap_engine import SwapEngine, EMPTY, GRID_WIDTH, GRID_HEIGHT, match_mask
+
+
+def brute_valid_moves(grid):
+    """Try every adjacent swap on a copy of the grid"""
+    moves = []
+    for cy in range(GRID_HEIGHT):
+        for cx in range(GRID_WIDTH):
+            for nx, ny in ((cx + 1, cy), (cx, cy + 1)):
+                if nx >= GRID_WIDTH or ny >= GRID_HEIGHT:
+                    continue
+                a, b = grid[cy, cx], grid[ny, nx]
+                if a == EMPTY or b == EMPTY or a == b:
+                    continue
+                swapped = grid.copy()
+                swapped[cy, cx], swapped[ny, nx] = b, a
+                mask = match_mask(swapped)
+                if mask[cy, cx] or mask[ny, nx]:
+                    moves.append(((cx, cy), (nx, ny)))
+    return sorted(moves)
+
+
+def assert_settled(engine):
+    assert (engine.color_grid != EMPTY).all()
+    assert not engine.has_empty_cells()
+    assert not engine.find_matches()
+    assert engine.valid_moves
+
+
+def test_valid_moves_match_brute_force():
+    rng = np.random.default_rng(0)
+    engine = SwapEngine()
+    for trial in range(200):
+        grid = rng.integers(0, [2, 3, 4, 6][trial % 4], size=(GRID_HEIGHT, GRID_WIDTH)).astype(np.int8)
+        grid[rng.random((GRID_HEIGHT, GRID_WIDTH)) < [0, 0.1, 0.3][trial % 3]] = EMPTY
+        engine.color_grid[:] = grid
+        assert sorted(engine.find_valid_moves()) == brute_valid_moves(grid)
+
+
+def test_local_matches_equal_full_scan():
+    rng = random.Random(1)
+    engine = SwapEngine()
+    engine.reset(1)
+    for _ in range(500):
+        cell1 = (rng.randrange(GRID_WIDTH - 1), rng.randrange(GRID_HEIGHT - 1))
+        cell2 = rng.choice([(cell1[0] + 1, cell1[1]), (cell1[0], cell1[1] + 1)])
+        engine.swap_cells(cell1, cell2)
+        assert engine.find_matches([cell1, cell2]) == engine.find_matches()
+        engine.swap_back(cell1, cell2)
+        if rng.random() < 0.2:
+            engine.swap(*rng.choice(engine.valid_moves))
+
+
+def test_board_stays_settled():
+    rng = random.Random(2)
+    for seed in range(5):
+        engine = SwapEngine(color_count=[3, 4, 6][seed % 3])
+        engine.reset(seed)
+        assert_settled(engine)
+        for _ in range(40):
+            if rng.random() < 0.1:
+                kind = rng.choice(['color', 'row', 'col'])
+                limit = engine.color_count if kind == 'color' else GRID_WIDTH
+                engine.bomb(kind, rng.randrange(limit))
+            else:
+                assert engine.swap(*rng.choice(engine.valid_moves))['valid']
+            assert_settled(engine)
+
+
+def test_reshuffle_breaks_deadlock():
+    engine = SwapEngine(color_count=3)
+    engine.reset(3)
+    # Diagonal stripes of three colors have no swap that makes a match
+    engine.color_grid[:] = np.indices((GRID_HEIGHT, GRID_WIDTH)).sum(axis=0) % 3
+    assert not engine.find_valid_moves()
+    engine.settle()
+    assert_settled(engine)
@@ -1,6 +1,6 @@
 import math
 import logging
-import pygame
+import functools
 
 from constants import BUBBLE_SIZE, BUBBLE_SPACE, GRID_WIDTH, GRID_HEIGHT
 
@@ -21,13 +21,32 @@ def highlight_color(color):
     return tuple([check_color_max(1.3*x) for x in color])
 
 
-def load_bubble_image(color):
-    surface = pygame.Surface((BUBBLE_SIZE, BUBBLE_SIZE), pygame.SRCALPHA)
-    border_width = 6
-    pygame.draw.circle(surface, border_color(color), (BUBBLE_SIZE // 2, BUBBLE_SIZE // 2), BUBBLE_SIZE // 2)
-    pygame.draw.circle(surface, color, (BUBBLE_SIZE // 2, BUBBLE_SIZE // 2), BUBBLE_SIZE // 2 - border_width)
-    pygame.draw.circle(surface, highlight_color(color), (BUBBLE_SIZE // 2, BUBBLE_SIZE // 2), BUBBLE_SIZE // 5)
-    return surface
+class SurfaceCache:
+    """Sprite surfaces shared by color, with one variant per alpha value.
+
+    Cached surfaces are shared between sprites and must not be modified;
+    ask for the alpha variant instead of calling ``set_alpha`` on them.
+    """
+
+    def __init__(self, loader):
+        self.loader = loader
+        self.surfaces = {}
+
+    def get(self, color, alpha=255):
+        alpha = int(alpha)
+        key = (color, alpha)
+        surface = self.surfaces.get(key)
+        if surface is None:
+            if alpha == 255:
+                surface = self.loader(color)
+            else:
+                surface = self.get(color).copy()
+                surface.set_alpha(alpha)
+            self.surfaces[key] = surface
+        return surface
+
+    def clear(self):
+        self.surfaces = {}
 
 
 def get_center(cx, cy):
@@ -37,12 +56,74 @@ def get_center(cx, cy):
     return x, y
 
 
+def get_cell(x, y):
+    """Inverse of get_center: the cell nearest to ``(x, y)``, ignoring grid bounds."""
+    cy = round((y - BUBBLE_SIZE // 2 - BUBBLE_SPACE) / (BUBBLE_SIZE * 0.8 + BUBBLE_SPACE))
+    shift = cy % 2
+    cx = round((x - (BUBBLE_SIZE // 2 + BUBBLE_SPACE // 2) * (shift + 1)) / (BUBBLE_SIZE + BUBBLE_SPACE//2))
+    return cx, cy
+
+
+def segment_cells(start, end, reach, width=GRID_WIDTH, height=GRID_HEIGHT):
+    """Yield the grid cells whose center may lie within ``reach`` of a segment.
+
+    Walks only the rows and columns the segment passes near, so the cost
+    follows the segment length rather than the grid size.
+    """
+    (x0, y0), (x1, y1) = start, end
+    row_height = BUBBLE_SIZE * 0.8 + BUBBLE_SPACE
+    col_width = BUBBLE_SIZE + BUBBLE_SPACE//2
+    first_y = get_center(0, 0)[1]
+    top = max(math.ceil((min(y0, y1) - reach - first_y) / row_height), 0)
+    bottom = min(math.floor((max(y0, y1) + reach - first_y) / row_height), height - 1)
+    for cy in range(top, bottom + 1):
+        row_x, row_y = get_center(0, cy)
+        # The part of the segment within reach of this row's centers
+        if y0 == y1:
+            t0, t1 = 0.0, 1.0
+        else:
+            t0 = (row_y - reach - y0) / (y1 - y0)
+            t1 = (row_y + reach - y0) / (y1 - y0)
+            t0, t1 = max(min(t0, t1), 0.0), min(max(t0, t1), 1.0)
+        xa, xb = sorted((x0 + t0 * (x1 - x0), x0 + t1 * (x1 - x0)))
+        left = max(math.ceil((xa - reach - row_x) / col_width), 0)
+        right = min(math.floor((xb + reach - row_x) / col_width), width - 1)
+        for cx in range(left, right + 1):
+            yield (cx, cy)
+
+
+def cell_index(cell):
+    """Index of ``cell`` in a flat row-major grid, or None when off the grid."""
+    cx, cy = cell
+    if 0 <= cx < GRID_WIDTH and 0 <= cy < GRID_HEIGHT:
+        return cy * GRID_WIDTH + cx
+    return None
+
+
+@functools.lru_cache(maxsize=512)
+def segment_centers(start, end, reach):
+    """Flat index and center of each of the segment_cells of a segment.
+
+    A shot at a given angle always runs the same segments until it hits
+    something, so repeated traces at that angle reuse the list.
+    """
+    return tuple((cell_index(cell), get_center(*cell)) for cell in segment_cells(start, end, reach))
+
+
+def index_cell(index):
+    return index % GRID_WIDTH, index // GRID_WIDTH
+
+
 def get_distance(point1, point2):
     return math.sqrt(
         (point1[0] - point2[0]) ** 2 + (point1[1] - point2[1]) ** 2
     )
 
 
+def get_angle(origin, target):
+    return math.atan2(target[1] - origin[1], target[0] - origin[0])
+
+
 def simple_neighbour_cells(cell):
     cx, cy = cell
     for next_cx, next_cy in [
@@ -66,7 +147,7 @@ def simple_neighbour_cells(cell):
 #    4  5  6
 #  7  8  9
 #   10 11 12
-def neighbour_cells(cell):
+def neighbour_cells(cell, width=GRID_WIDTH, height=GRID_HEIGHT):
     cx, cy = cell
     if cy % 2 == 1: # 5 is selected
         neighbours = [
@@ -93,11 +174,29 @@ def neighbour_cells(cell):
     for next_cx, next_cy in neighbours:
         if next_cx < 0 or next_cy < 0:
             continue
-        if next_cx >= GRID_WIDTH or next_cy >= GRID_HEIGHT:
+        if next_cx >= width or next_cy >= height:
             continue
         yield (next_cx, next_cy)
 
 
+@functools.lru_cache(maxsize=None)
+def neighbour_table(width=GRID_WIDTH, height=GRID_HEIGHT):
+    """Flat indices of the neighbour_cells of every cell, by flat index.
+
+    Built once per grid size so flood fills can walk row-major indices
+    without allocating cells or checking bounds.
+    """
+    return tuple(
+        tuple(next_cy * width + next_cx
+              for next_cx, next_cy in neighbour_cells((cx, cy), width, height))
+        for cy in range(height)
+        for cx in range(width)
+    )
+
+
+NEIGHBOURS = neighbour_table()
+
+
 def draw_multiline_text(surface, text, pos, font, color=(255, 255, 255), line_spacing=6):
     x, y = pos
     lines = text